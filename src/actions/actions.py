@@ -36,6 +36,8 @@ import charms_openstack.charm as charm
 import charmhelpers.core as ch_core
 
 import charm.openstack.ironic.api_utils as api_utils
+import charm.openstack.ironic.controller_utils as controller_utils
+import charm.openstack.ironic.profiling as profiling
 
 charms_openstack.bus.discover()
 
@@ -67,19 +69,27 @@ def set_temp_url_secret(*args):
         ch_core.hookenv.action_fail(
             'Glance not yet available. Please wait for deployment to finish')
 
-    if "swift" not in os_cli.glance_stores:
+    # The glance stores and the swift account are independent requests to
+    # two services, run them concurrently.
+    probes = api_utils.run_concurrently({
+        "glance_stores": lambda: os_cli.glance_stores,
+        "account_properties": os_cli.get_object_account_properties,
+    })
+
+    if "swift" not in probes["glance_stores"]:
         ch_core.hookenv.action_fail(
             'Glance does not support Swift storage backend. '
             'Please add relation between glance and ceph-radosgw/swift')
 
     current_secret = leadership.leader_get("temp_url_secret")
-    current_swift_secret = os_cli.get_object_account_properties().get(
-        'temp-url-key', None)
+    account_properties = probes["account_properties"]
+    current_swift_secret = account_properties.get('temp-url-key', None)
 
     if not current_secret or current_swift_secret != current_secret:
         secret = hashlib.sha1(
             str(uuid.uuid4()).encode()).hexdigest()
-        os_cli.set_object_account_property("temp-url-key", secret)
+        os_cli.set_object_account_property(
+            "temp-url-key", secret, current_props=account_properties)
         leadership.leader_set({"temp_url_secret": secret})
         # render configs on leader, and assess status. Every other unit
         # will render theirs when leader-settings-changed executes.
@@ -97,8 +107,84 @@ def set_temp_url_secret(*args):
             ironic_charm._assess_status()
 
 
+def prefetch_images(*args):
+    """Download Glance images into the conductor master image cache"""
+    if not reactive.is_flag_set('config.complete'):
+        return ch_core.hookenv.action_fail('required relations are not yet '
+                                           'available, please defer action '
+                                           'until deployment is complete.')
+    image_ids = ch_core.hookenv.action_get(
+        'image-ids').replace(",", " ").split()
+    if not image_ids:
+        return ch_core.hookenv.action_fail('no image IDs were given')
+
+    identity_service = reactive.endpoint_from_flag(
+        'identity-credentials.available')
+    try:
+        keystone_session = api_utils.create_keystone_session(identity_service)
+    except Exception as e:
+        ch_core.hookenv.action_fail('Failed to create keystone session ("{}")'
+                                    .format(e))
+        return
+
+    cache = ch_core.hookenv.action_get('cache')
+    with charm.provide_charm_instance() as ironic_charm:
+        master_dir = ironic_charm.config["image_cache"][
+            "{}_master_path".format(cache)]
+        conversion = ironic_charm.config["image_conversion"]
+    # ironic-conductor fetches the deploy kernels and ramdisks with
+    # force_raw too, although they are raw already and are never converted.
+    force_raw = conversion.get("force_raw_images", True)
+    memory_limit = conversion.get("image_convert_memory_limit")
+
+    os_cli = api_utils.OSClients(keystone_session)
+    cached = []
+    failed = []
+    for image_id in image_ids:
+        try:
+            controller_utils.prefetch_image(
+                os_cli, image_id, master_dir, force_raw=force_raw,
+                memory_limit=memory_limit)
+            cached.append(image_id)
+        except Exception as e:
+            ch_core.hookenv.log('failed to prefetch image {}: "{}"'
+                                .format(image_id, e),
+                                level=ch_core.hookenv.ERROR)
+            failed.append(image_id)
+
+    ch_core.hookenv.action_set({
+        'cached': ", ".join(cached),
+        'failed': ", ".join(failed),
+    })
+    if failed:
+        ch_core.hookenv.action_fail(
+            'Failed to prefetch images: {}'.format(", ".join(failed)))
+
+
+def show_hook_timings(*args):
+    """Report the slowest hook phases recorded by hook profiling"""
+    hook = ch_core.hookenv.action_get('hook') or None
+    count = ch_core.hookenv.action_get('count') or 10
+    summaries = profiling.load_summaries(hook=hook)
+    if not summaries:
+        return ch_core.hookenv.action_fail(
+            'no hook timings found, enable the hook-profiling config '
+            'option first')
+
+    phases = profiling.get_slowest_phases(summaries, count=count)
+    lines = [
+        "{hook} {phase}: calls={calls} mean={mean:.3f}s max={max:.3f}s"
+        .format(**i) for i in phases]
+    ch_core.hookenv.action_set({
+        'hooks': len(summaries),
+        'timings': "\n".join(lines),
+    })
+
+
 ACTIONS = {
     'set-temp-url-secret': set_temp_url_secret,
+    'prefetch-images': prefetch_images,
+    'show-hook-timings': show_hook_timings,
 }
 
 
@@ -1,15 +1,84 @@
+import concurrent.futures
+import json
+import os
+
 from keystoneauth1 import loading
 from keystoneauth1 import session as ks_session
 from keystoneauth1 import exceptions as ks_exc
 
 import glanceclient
 import swiftclient
-import keystoneclient
+
+import charmhelpers.core.hookenv as hookenv
 
 SYSTEM_CA_BUNDLE = '/etc/ssl/certs/ca-certificates.crt'
+IRONIC_API_VERSION_HEADER = 'X-OpenStack-Ironic-API-Version'
+# Timeout, in seconds, of every API request, and number of retries of the
+# requests that failed to connect.
+API_TIMEOUT = 30
+API_RETRIES = 3
+# Maximum number of nodes looked at when counting the nodes locked by a
+# conductor, so the check takes a single request however large the
+# deployment is.
+MAX_RESERVATION_SCAN = 1000
+# File in the charm dir caching the keystone tokens, and their service
+# catalog, across hooks and actions.
+AUTH_STATE_FILE = '.keystone-auth-state'
+
+# Sessions created during this hook or action, by auth plugin cache id.
+_SESSIONS = {}
+
+
+def _get_auth_state_path():
+    return os.path.join(hookenv.charm_dir(), AUTH_STATE_FILE)
+
+
+def _load_auth_states():
+    try:
+        with open(_get_auth_state_path()) as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_auth_states(states):
+    path = _get_auth_state_path()
+    # the file holds tokens, keep it private
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as state_file:
+        json.dump(states, state_file)
+
+
+def _cache_auth_state(auth, session):
+    """Reuse the token cached for these credentials, or cache a new one.
+
+    keystoneauth checks the expiry of the cached token, and authenticates
+    again if it expired or is about to, in which case the new token is
+    cached instead.
+    """
+    cache_id = auth.get_cache_id()
+    states = _load_auth_states()
+    state = states.get(cache_id)
+    if state:
+        auth.set_auth_state(state)
+    session.get_token()
+    new_state = auth.get_auth_state()
+    if new_state != state:
+        states[cache_id] = new_state
+        try:
+            _save_auth_states(states)
+        except OSError as err:
+            hookenv.log("failed to cache the keystone token: %s" % err,
+                        level=hookenv.WARNING)
 
 
 def create_keystone_session(keystone):
+    """Create a keystone session from the identity-credentials relation.
+
+    The session is authenticated with the token cached on disk, if it is
+    still valid. Calls made with the same credentials during the same hook
+    return the same session.
+    """
     plugin_name = "password"
     username = keystone.credentials_username()
     password = keystone.credentials_password()
@@ -43,21 +112,108 @@ def create_keystone_session(keystone):
 
     loader = loading.get_plugin_loader(plugin_name)
     auth = loader.load_from_options(**plugin_args)
-    return ks_session.Session(auth=auth, verify=SYSTEM_CA_BUNDLE)
+    cache_id = auth.get_cache_id()
+    if cache_id is None:
+        return ks_session.Session(
+            auth=auth, verify=SYSTEM_CA_BUNDLE, timeout=API_TIMEOUT)
+    if cache_id in _SESSIONS:
+        return _SESSIONS[cache_id]
+    session = ks_session.Session(
+        auth=auth, verify=SYSTEM_CA_BUNDLE, timeout=API_TIMEOUT)
+    _cache_auth_state(auth, session)
+    _SESSIONS[cache_id] = session
+    return session
+
+
+def get_reserved_nodes(session, conductor):
+    """Get the nodes a conductor currently holds a lock on.
+
+    Only the nodes mapped to the conductor by the hash ring are looked at,
+    up to MAX_RESERVATION_SCAN of them.
+
+    :param session: the keystone session used to query the Ironic API.
+    :param conductor: the host name of the conductor.
+    :returns: list of the UUIDs of the nodes reserved by the conductor.
+    """
+    # The node list can not be filtered by reservation, so only fetch
+    # the fields needed.
+    resp = session.get(
+        "/v1/nodes?conductor=%s&fields=uuid,reservation&limit=%d" % (
+            conductor, MAX_RESERVATION_SCAN),
+        endpoint_filter={
+            "service_type": "baremetal",
+            "interface": "internal",
+        },
+        headers={IRONIC_API_VERSION_HEADER: "1.49"})
+    body = resp.json()
+    if body.get("next"):
+        hookenv.log("conductor %s manages more than %d nodes, only the "
+                    "first ones were checked for locks" % (
+                        conductor, MAX_RESERVATION_SCAN),
+                    level=hookenv.DEBUG)
+    return [node["uuid"] for node in body.get("nodes", [])
+            if node.get("reservation") == conductor]
+
+
+def is_conductor_alive(session, conductor):
+    """Check whether a conductor is registered in the hash ring.
+
+    :param session: the keystone session used to query the Ironic API.
+    :param conductor: the host name of the conductor.
+    :returns: True if the conductor is registered and alive.
+    """
+    resp = session.get(
+        "/v1/conductors/%s" % conductor,
+        endpoint_filter={
+            "service_type": "baremetal",
+            "interface": "internal",
+        },
+        headers={IRONIC_API_VERSION_HEADER: "1.49"},
+        raise_exc=False)
+    if resp.status_code == 404:
+        return False
+    resp.raise_for_status()
+    return bool(resp.json().get("alive"))
+
+
+def run_concurrently(calls):
+    """Run API calls concurrently.
+
+    :param calls: dict mapping a name to a callable taking no arguments.
+    :returns: dict mapping the names to the values returned by the calls.
+    :raises: the exception raised by a failed call.
+    """
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(len(calls), 1)) as executor:
+        futures = dict(
+            (name, executor.submit(call)) for name, call in calls.items())
+        return dict(
+            (name, future.result()) for name, future in futures.items())
 
 
 class OSClients(object):
 
     def __init__(self, session):
         self._session = session
-        self._img_cli = glanceclient.Client(
-            session=self._session, version=2)
-        self._obj_cli = swiftclient.Connection(
-            session=self._session, cacert=SYSTEM_CA_BUNDLE)
-        self._ks = keystoneclient.v3.Client(
-            session=session)
+        self._clients = {}
         self._stores = None
 
+    @property
+    def _img_cli(self):
+        if "image" not in self._clients:
+            self._clients["image"] = glanceclient.Client(
+                session=self._session, version=2,
+                connect_retries=API_RETRIES)
+        return self._clients["image"]
+
+    @property
+    def _obj_cli(self):
+        if "object-store" not in self._clients:
+            self._clients["object-store"] = swiftclient.Connection(
+                session=self._session, cacert=SYSTEM_CA_BUNDLE,
+                retries=API_RETRIES, timeout=API_TIMEOUT)
+        return self._clients["object-store"]
+
     @property
     def _stores_info(self):
         if self._stores:
@@ -77,16 +233,35 @@ class OSClients(object):
                 return stor["id"]
         raise ValueError("no default store set")
 
+    def get_image(self, image_id):
+        return self._img_cli.images.get(image_id)
+
+    def download_image(self, image_id, path):
+        data = self._img_cli.images.data(image_id)
+        with open(path, "wb") as fd:
+            for chunk in data:
+                fd.write(chunk)
+
     def get_object_account_properties(self):
-        acct = self._obj_cli.get_account()
+        # HEAD the account, there is no need to list its containers
+        headers = self._obj_cli.head_account()
         props = {}
-        for prop, val in acct[0].items():
+        for prop, val in headers.items():
             if prop.startswith('x-account-meta-'):
                 props[prop.replace("x-account-meta-", "")] = val
         return props
 
-    def set_object_account_property(self, prop, value):
-        current_props = self.get_object_account_properties()
+    def set_object_account_property(self, prop, value, current_props=None):
+        """Set an account metadata property, if it changed.
+
+        :param prop: the property name.
+        :param value: the property value.
+        :param current_props: the account properties, as returned by
+                              get_object_account_properties(). They are
+                              fetched when not given.
+        """
+        if current_props is None:
+            current_props = self.get_object_account_properties()
         prop = prop.lower()
         if current_props.get(prop, None) == value:
             return
@@ -103,13 +278,14 @@ class OSClients(object):
         self._obj_cli.post_account(headers)
 
     def _has_service_type(self, svc_type, interface="public"):
+        # The service catalog comes with the token, so this does not need
+        # any request to keystone once the session is authenticated.
         try:
-            svc = self._ks.services.find(type=svc_type)
-            self._ks.endpoints.find(
-                service_id=svc.id, interface=interface)
-        except ks_exc.http.NotFound:
+            endpoint = self._session.get_endpoint(
+                service_type=svc_type, interface=interface)
+        except ks_exc.EndpointNotFound:
             return False
-        return True
+        return endpoint is not None
 
     def has_swift(self):
         return self._has_service_type("object-store")
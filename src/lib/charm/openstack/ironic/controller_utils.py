@@ -1,13 +1,130 @@
+import hashlib
 import os
 import shutil
+import subprocess
+import tempfile
 
-import charmhelpers.core.host as ch_host
+import charmhelpers.core.unitdata as unitdata
 import charmhelpers.contrib.openstack.utils as ch_utils
 
 
 _IRONIC_USER = "ironic"
 _IRONIC_GROUP = "ironic"
 
+# unitdata key holding the manifest of the boot loaders copied into the
+# TFTP root.
+_RESOURCES_MANIFEST_KEY = "ironic-conductor.pxe-resources-manifest"
+
+# Glance disk formats that ironic never converts when caching images.
+_RAW_DISK_FORMATS = ["raw", "aki", "ari"]
+# Suffix ironic appends to the master files of the images it fetched with
+# force_raw, whether or not they needed converting.
+_CONVERTED_SUFFIX = ".converted"
+
+
+def file_digest(path):
+    """Return the sha256 hex digest of the file at path."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_free_space(path):
+    """Return the number of bytes available on the filesystem of path.
+
+    If path does not exist yet, the filesystem of its closest existing
+    parent is used.
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def get_dir_usage(path):
+    """Return the number of bytes used by the files directly in path."""
+    if not os.path.isdir(path):
+        return 0
+    usage = 0
+    for entry in os.scandir(path):
+        if entry.is_file(follow_symlinks=False):
+            usage += entry.stat(follow_symlinks=False).st_size
+    return usage
+
+
+def prefetch_image(os_cli, image_id, master_dir, force_raw=True,
+                   memory_limit=None):
+    """Download a Glance image into an ironic master image cache.
+
+    The image is stored the way ironic-conductor stores it, so the
+    conductor links it from the cache instead of downloading it. On every
+    release the charm supports (Train and later),
+    ironic.drivers.modules.image_cache.ImageCache.fetch_image():
+
+    - names the master file after the Glance image ID, with a ".converted"
+      suffix when the image is fetched with force_raw;
+    - considers the master file of a Glance image up to date as long as it
+      exists, since the content of a Glance image never changes. The
+      updated_at of the image is only compared with the mtime of the master
+      files of images served over HTTP;
+    - removes master files whose mtime is older than the cache TTL.
+
+    The master file therefore gets the mtime of the download, as when the
+    conductor fetches it, and the mtime of an already cached image is
+    refreshed to keep it in the cache for another TTL.
+
+    :param os_cli: an api_utils.OSClients instance.
+    :param image_id: the ID of the Glance image.
+    :param master_dir: the master images folder of the cache.
+    :param force_raw: convert the image to raw, as ironic-conductor does
+        when force_raw_images is enabled.
+    :param memory_limit: limit, in MiB, of the address space of qemu-img
+        convert, as enforced by ironic-conductor.
+    :returns: the path to the cached image.
+    """
+    master_name = image_id
+    if force_raw:
+        master_name += _CONVERTED_SUFFIX
+    master_path = os.path.join(master_dir, master_name)
+    if os.path.isfile(master_path):
+        os.utime(master_path)
+        return master_path
+
+    image = os_cli.get_image(image_id)
+    if not os.path.isdir(master_dir):
+        os.makedirs(master_dir)
+        shutil.chown(master_dir, _IRONIC_USER, _IRONIC_GROUP)
+    size = image.get("size") or 0
+    needed = size * 2 if force_raw else size
+    if needed > get_free_space(master_dir):
+        raise ValueError(
+            "Not enough free space in %s to cache image %s" % (
+                master_dir, image_id))
+
+    tmp_dir = tempfile.mkdtemp(dir=master_dir)
+    try:
+        image_path = os.path.join(tmp_dir, image_id)
+        os_cli.download_image(image_id, image_path + ".part")
+        disk_format = image.get("disk_format")
+        if force_raw and disk_format not in _RAW_DISK_FORMATS:
+            cmd = [
+                "qemu-img", "convert", "-O", "raw",
+                image_path + ".part", image_path]
+            if memory_limit:
+                cmd = ["prlimit", "--as=%d" % (memory_limit * 1024 * 1024),
+                       "--"] + cmd
+            subprocess.check_call(cmd)
+        else:
+            os.rename(image_path + ".part", image_path)
+        shutil.chown(image_path, _IRONIC_USER, _IRONIC_GROUP)
+        os.rename(image_path, master_path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return master_path
+
 
 class PXEBootBase(object):
 
@@ -18,6 +135,11 @@ class PXEBootBase(object):
     GRUB_CFG = os.path.join(GRUB_DIR, "grub.cfg")
     MAP_FILE = os.path.join(TFTP_ROOT, "map-file")
     TFTP_CONFIG = "/etc/default/tftpd-hpa"
+    # Master image caches of ironic-conductor. The TFTP cache holds deploy
+    # kernels and ramdisks, the instance cache holds the images written to
+    # nodes.
+    TFTP_MASTER_PATH = os.path.join(TFTP_ROOT, "master_images")
+    INSTANCE_MASTER_PATH = "/var/lib/ironic/master_images"
 
     # This is a file map of source to destination. The destination is
     # relative to self.TFTP_ROOT
@@ -30,6 +152,13 @@ class PXEBootBase(object):
         "/usr/lib/ipxe/undionly.kpxe": "undionly.kpxe",
         "/usr/lib/ipxe/ipxe.efi": "ipxe.efi",
     }
+    # The UEFI boot loaders fetched over HTTP by nodes using UEFI HTTP
+    # boot. The destination is relative to self.HTTP_ROOT
+    HTTP_FILE_MAP = {
+        "/usr/lib/grub/x86_64-efi-signed/grubnetx64.efi.signed": "grubx64.efi",
+        "/usr/lib/shim/shimx64.efi.signed": "bootx64.efi",
+        "/usr/lib/ipxe/ipxe.efi": "ipxe.efi",
+    }
 
     TFTP_PACKAGES = ["tftpd-hpa"]
     TFTPD_SERVICE = "tftpd-hpa"
@@ -65,32 +194,76 @@ class PXEBootBase(object):
             self.PACKAGES + self.TFTP_PACKAGES + self.HTTPD_PACKAGES)
         return default_packages
 
-    def _copy_resources(self):
-        self._ensure_folders()
-        for f in self.FILE_MAP:
-            if os.path.isfile(f) is False:
-                raise ValueError(
-                    "Missing required file %s. Package not installed?" % f)
-            shutil.copy(
-                f, os.path.join(self.TFTP_ROOT, self.FILE_MAP[f]),
-                follow_symlinks=True)
-        ch_host.chownr(
-            self.TFTP_ROOT, _IRONIC_USER, _IRONIC_GROUP, chowntopdir=True)
+    def _is_resource_current(self, src, dst, entry):
+        """Check if dst is an up to date copy of src.
 
-    def _ensure_folders(self):
-        if os.path.isdir(self.TFTP_ROOT) is False:
-            os.makedirs(self.TFTP_ROOT)
+        The manifest entry records the stat info of both the source and
+        destination files, as they were when dst was last synced. When
+        neither of them changed since, there is no need to read the files.
+        Otherwise we fall back to comparing the content digests.
 
-        if os.path.isdir(self.HTTP_ROOT) is False:
-            os.makedirs(self.HTTP_ROOT)
+        :param src: path to the boot loader shipped by the package.
+        :param dst: path to the copy in the TFTP root.
+        :param entry: the manifest entry recorded for dst, or None.
+        :returns: tuple of (current, source digest). The digest is None if
+            it was not computed.
+        """
+        if not os.path.isfile(dst):
+            return (False, None)
+        src_stat = os.stat(src)
+        dst_stat = os.stat(dst)
+        if entry and (
+                entry.get("source_mtime") == src_stat.st_mtime and
+                entry.get("source_size") == src_stat.st_size and
+                entry.get("mtime") == dst_stat.st_mtime and
+                entry.get("size") == dst_stat.st_size):
+            return (True, entry.get("digest"))
+        src_digest = file_digest(src)
+        return (src_digest == file_digest(dst), src_digest)
 
-        if os.path.isdir(self.GRUB_DIR) is False:
-            os.makedirs(self.GRUB_DIR)
+    def _get_resource_maps(self):
+        """Return the boot loaders to copy, as (root, file map) tuples."""
+        maps = [(self.TFTP_ROOT, self.FILE_MAP)]
+        if self._config.get("uefi-http-boot"):
+            maps.append((self.HTTP_ROOT, self.HTTP_FILE_MAP))
+        return maps
 
-        ch_host.chownr(
-            self.TFTP_ROOT, _IRONIC_USER, _IRONIC_GROUP, chowntopdir=True)
-        ch_host.chownr(
-            self.HTTP_ROOT, _IRONIC_USER, _IRONIC_GROUP, chowntopdir=True)
+    def _copy_resources(self):
+        self._ensure_folders()
+        db = unitdata.kv()
+        manifest = db.get(_RESOURCES_MANIFEST_KEY, {})
+        updated = {}
+        for root, file_map in self._get_resource_maps():
+            for f in file_map:
+                if os.path.isfile(f) is False:
+                    raise ValueError(
+                        "Missing required file %s. Package not installed?" % f)
+                dst = os.path.join(root, file_map[f])
+                current, digest = self._is_resource_current(
+                    f, dst, manifest.get(dst))
+                if not current:
+                    shutil.copy(f, dst, follow_symlinks=True)
+                    shutil.chown(dst, _IRONIC_USER, _IRONIC_GROUP)
+                src_stat = os.stat(f)
+                dst_stat = os.stat(dst)
+                updated[dst] = {
+                    "digest": digest or file_digest(f),
+                    "source_mtime": src_stat.st_mtime,
+                    "source_size": src_stat.st_size,
+                    "mtime": dst_stat.st_mtime,
+                    "size": dst_stat.st_size,
+                }
+        if updated != manifest:
+            db.set(_RESOURCES_MANIFEST_KEY, updated)
+
+    def _ensure_folders(self):
+        # Only the folders themselves are chowned. Their contents are either
+        # managed by ironic-conductor, or by _copy_resources(), which sets
+        # ownership on the files it copies.
+        for folder in (self.TFTP_ROOT, self.HTTP_ROOT, self.GRUB_DIR):
+            if os.path.isdir(folder) is False:
+                os.makedirs(folder)
+            shutil.chown(folder, _IRONIC_USER, _IRONIC_GROUP)
 
 
 class PXEBootYoga(PXEBootBase):
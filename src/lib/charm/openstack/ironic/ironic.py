@@ -1,7 +1,16 @@
 from __future__ import absolute_import
 
 import collections
+import configparser
+import contextlib
+import hashlib
+import json
 import os
+import re
+import socket
+import subprocess
+import time
+import urllib.parse
 from copy import deepcopy
 
 import charms_openstack.charm
@@ -13,15 +22,21 @@ from charms_openstack.adapters import (
 )
 from charmhelpers.contrib.openstack.utils import (
     CompareOpenStackReleases,
+    is_unit_paused_set,
     os_release,
 )
 from charmhelpers.contrib.openstack import templating
 from charmhelpers.core import host
+from charmhelpers.core import hookenv
+from charmhelpers.core import unitdata
+from charmhelpers import fetch
 
+import charm.openstack.ironic.api_utils as api_utils
 import charm.openstack.ironic.controller_utils as controller_utils
+import charm.openstack.ironic.profiling as profiling
+import charm.openstack.ironic.rolling_restart as rolling_restart
 import charms_openstack.adapters as adapters
 import charmhelpers.contrib.network.ip as ch_ip
-import charmhelpers.contrib.openstack.utils as ch_utils
 import charms.leadership as leadership
 import charms.reactive as reactive
 
@@ -55,11 +70,215 @@ IRONIC_LIB_FILTERS = os.path.join(
 IRONIC_UTILS_FILTERS = os.path.join(
     FILTERS_DIR, "ironic-utils.filters")
 TFTP_CONF = "/etc/default/tftpd-hpa"
+DEPLOY_LOGS_CLEANUP = "ironic-deploy-logs-cleanup"
+DEPLOY_LOGS_CLEANUP_SCRIPT = os.path.join(
+    "/usr/local/sbin", DEPLOY_LOGS_CLEANUP)
+DEPLOY_LOGS_CLEANUP_SERVICE = os.path.join(
+    "/etc/systemd/system", DEPLOY_LOGS_CLEANUP + ".service")
+DEPLOY_LOGS_CLEANUP_TIMER = os.path.join(
+    "/etc/systemd/system", DEPLOY_LOGS_CLEANUP + ".timer")
 HTTP_SERVER_CONF = "/etc/nginx/nginx.conf"
 VALID_NETWORK_INTERFACES = ["neutron", "flat", "noop"]
 VALID_DEPLOY_INTERFACES = ["direct", "iscsi"]
 DEFAULT_DEPLOY_IFACE = "flat"
 DEFAULT_NET_IFACE = "direct"
+VALID_CONDUCTOR_TUNING_MODES = ["manual", "auto"]
+
+# Maps the charm config options used to tune the conductor worker pools to
+# the [conductor] options in ironic.conf.
+_CONDUCTOR_TUNING_OPTIONS = collections.OrderedDict([
+    ('conductor-workers-pool-size', 'workers_pool_size'),
+    ('conductor-periodic-max-workers', 'periodic_max_workers'),
+    ('sync-power-state-workers', 'sync_power_state_workers'),
+    ('sync-power-state-interval', 'sync_power_state_interval'),
+    ('power-state-sync-max-retries', 'power_state_sync_max_retries'),
+])
+# Ironic defaults for the options above. Used when validating the effective
+# pool sizes of a partially tuned conductor.
+_CONDUCTOR_TUNING_DEFAULTS = {
+    'workers_pool_size': 100,
+    'periodic_max_workers': 8,
+    'sync_power_state_workers': 8,
+    'sync_power_state_interval': 60,
+    'power_state_sync_max_retries': 3,
+}
+# Maps the charm config options used to tune the IPMI driver to the [ipmi]
+# options in ironic.conf, and the Ironic defaults for them.
+_IPMI_TUNING_OPTIONS = collections.OrderedDict([
+    ('ipmi-command-retry-timeout', 'command_retry_timeout'),
+    ('ipmi-min-command-interval', 'min_command_interval'),
+    ('ipmi-kill-on-timeout', 'kill_on_timeout'),
+    ('ipmi-disable-boot-timeout', 'disable_boot_timeout'),
+])
+_IPMI_TUNING_DEFAULTS = {
+    'command_retry_timeout': 60,
+    'min_command_interval': 5,
+    'kill_on_timeout': True,
+    'disable_boot_timeout': True,
+}
+# Maps the charm config options used to tune the Redfish driver to the
+# [redfish] options in ironic.conf.
+_REDFISH_TUNING_OPTIONS = collections.OrderedDict([
+    ('redfish-connection-cache-size', 'connection_cache_size'),
+    ('redfish-connection-attempts', 'connection_attempts'),
+    ('redfish-connection-retry-interval', 'connection_retry_interval'),
+    ('redfish-auth-type', 'auth_type'),
+])
+# Hardware types talking to their BMCs through sushy.
+_REDFISH_HW_TYPES = ["redfish", "idrac"]
+# Redfish settings used unless set explicitly. Sessions are reused across
+# power syncs for up to connection_cache_size BMCs, instead of the 1000 sushy
+# caches by default, and unreachable BMCs are given up on sooner than with
+# the sushy defaults of 5 attempts, 4 seconds apart.
+_REDFISH_TUNING_DEFAULTS = {
+    'connection_cache_size': 5000,
+    'connection_attempts': 3,
+    'connection_retry_interval': 2,
+    'auth_type': 'session',
+}
+VALID_REDFISH_AUTH_TYPES = ["session", "basic", "auto"]
+# Maps the charm config options used to tune the database connection pool
+# to the [database] options in ironic.conf.
+_DATABASE_TUNING_OPTIONS = collections.OrderedDict([
+    ('database-max-pool-size', 'max_pool_size'),
+    ('database-max-overflow', 'max_overflow'),
+    ('database-pool-timeout', 'pool_timeout'),
+    ('database-connection-recycle-time', 'connection_recycle_time'),
+    ('database-max-retries', 'db_max_retries'),
+])
+# oslo.db defaults for the pool size and overflow. Periodic tasks and power
+# syncs hold connections while RPC requests come in, so the pool is sized
+# from the worker counts instead, up to MAX_DATABASE_POOL_SIZE.
+_DATABASE_POOL_DEFAULTS = {
+    'max_pool_size': 5,
+    'max_overflow': 50,
+}
+MAX_DATABASE_POOL_SIZE = 64
+MAX_PORT = 65535
+# Peer relation of the conductors, used to count the units of the
+# application.
+PEER_RELATION = rolling_restart.PEER_RELATION
+# Maps the charm config options used to tune the hash ring to the
+# [DEFAULT] options in ironic.conf.
+_HASH_RING_OPTIONS = collections.OrderedDict([
+    ('hash-partition-exponent', 'hash_partition_exponent'),
+    ('hash-ring-reset-interval', 'hash_ring_reset_interval'),
+])
+# Conductor group names Ironic accepts.
+VALID_CONDUCTOR_GROUP = re.compile(r'^[a-zA-Z0-9_\-\.]*$')
+MAX_CONDUCTOR_GROUP_LENGTH = 255
+VALID_HTTP_BOOT_PROFILES = ["default", "mass-boot"]
+# The http and http-ipxe boot interfaces, used for UEFI HTTP boot, were
+# added to Ironic in 21.0.0, released with Zed.
+UEFI_HTTP_BOOT_MIN_RELEASE = 'zed'
+# TFTP server settings of each tftp-boot-profile. A retransmit timeout of 0
+# uses the tftpd-hpa default.
+_TFTP_PROFILES = {
+    'default': {
+        'verbosity': 5,
+        'retransmit': 0,
+    },
+    'mass-boot': {
+        'verbosity': 0,
+        'retransmit': 250000,
+    },
+}
+# Maps the charm config options used to tune oslo.messaging to their
+# section and option in ironic.conf.
+_MESSAGING_OPTIONS = collections.OrderedDict([
+    ('rpc-executor-thread-pool-size',
+     ('DEFAULT', 'executor_thread_pool_size')),
+    ('rpc-response-timeout', ('DEFAULT', 'rpc_response_timeout')),
+    ('rabbit-qos-prefetch-count',
+     ('oslo_messaging_rabbit', 'rabbit_qos_prefetch_count')),
+    ('rabbit-heartbeat-timeout-threshold',
+     ('oslo_messaging_rabbit', 'heartbeat_timeout_threshold')),
+    ('rabbit-heartbeat-rate', ('oslo_messaging_rabbit', 'heartbeat_rate')),
+    ('rabbit-quorum-queues', ('oslo_messaging_rabbit', 'rabbit_quorum_queue')),
+])
+# Messaging settings of each messaging-profile. bulk-provisioning handles
+# more RPC requests at the same time, gives busy conductors more time to
+# answer, bounds the unacknowledged messages redelivered when a consumer
+# reconnects, and tolerates heartbeats delayed by a loaded conductor
+# instead of dropping its connection.
+_MESSAGING_PROFILES = {
+    'default': {},
+    'bulk-provisioning': {
+        'executor_thread_pool_size': 128,
+        'rpc_response_timeout': 180,
+        'rabbit_qos_prefetch_count': 64,
+        'heartbeat_timeout_threshold': 120,
+    },
+}
+# Maps the charm config options used to tune node cleaning to the [deploy]
+# options in ironic.conf. The priorities and the number of shred iterations
+# are left to Ironic when set to -1, as 0 is a meaningful value for them.
+_CLEANING_OPTIONS = collections.OrderedDict([
+    ('erase-devices-priority', 'erase_devices_priority'),
+    ('erase-devices-metadata-priority', 'erase_devices_metadata_priority'),
+    ('shred-random-overwrite-iterations',
+     'shred_random_overwrite_iterations'),
+    ('disk-erasure-concurrency', 'disk_erasure_concurrency'),
+])
+# Cleaning settings of each cleaning-profile. fast-clean still erases every
+# disk, with ATA secure erase or NVMe format when the disk supports it, but
+# falls back to a single pass of zeros instead of random data followed by
+# zeros, and erases up to 8 disks of a node at the same time.
+_CLEANING_PROFILES = {
+    'default': {},
+    'fast-clean': {
+        'shred_random_overwrite_iterations': 0,
+        'shred_final_overwrite_with_zeros': True,
+        'disk_erasure_concurrency': 8,
+    },
+}
+# RPC transports between ironic-api and the conductors. json-rpc calls the
+# conductors directly over HTTP, RabbitMQ is then only used for
+# notifications.
+VALID_RPC_TRANSPORTS = ["oslo", "json-rpc"]
+DEFAULT_JSON_RPC_PORT = 8089
+# Relation to the ironic-api application, the conductor publishes its RPC
+# transport on it.
+IRONIC_API_RELATION = "ironic-api"
+# Where the keystone tokens validated by the conductor are cached: nowhere,
+# in a memcached installed on the unit, or in the memcached units related
+# through MEMCACHE_RELATION.
+VALID_TOKEN_CACHES = ["none", "local", "relation"]
+MEMCACHE_RELATION = "memcache"
+MEMCACHED = "memcached"
+LOCAL_MEMCACHE_SERVER = "127.0.0.1:11211"
+DEFAULT_MEMCACHE_PORT = 11211
+VALID_TFTP_IP_VERSIONS = ["4", "6", "any"]
+VALID_TFTP_REFUSE_OPTIONS = [
+    "blksize", "blksize2", "tsize", "timeout", "utimeout", "rollover"]
+MAX_TFTP_VERBOSITY = 5
+# Defaults used when sizing the master image caches.
+DEFAULT_IMAGE_CACHE_TTL = 10080
+DEFAULT_IMAGE_CACHE_FREE_SPACE_PERCENT = 50
+# The computed image cache size is only updated when the new size differs
+# by more than this percentage, so ironic.conf does not change, and the
+# conductor is not restarted, every time the free disk space moves a bit.
+IMAGE_CACHE_SIZE_TOLERANCE_PERCENT = 10
+# Time, in seconds, the disk usage of the image caches and deploy logs is
+# reported for before the directories are walked again.
+DIR_USAGE_MAX_AGE = 3600
+MIB = 1024 * 1024
+# Ironic defaults of [DEFAULT] image_download_concurrency, and of the memory
+# limit, in MiB, of qemu-img convert ([disk_utils] image_convert_memory_limit).
+DEFAULT_IMAGE_DOWNLOAD_CONCURRENCY = 20
+DEFAULT_IMAGE_CONVERT_MEMORY_LIMIT = 2048
+# Share of the RAM of the unit the concurrent image conversions may use.
+IMAGE_CONVERSION_RAM_PERCENT = 50
+# Time, in seconds, a restarted conductor keeps its restart token while
+# waiting to rejoin the hash ring. Past that, the token is released anyway,
+# so a conductor that never shows up in the hash ring does not block the
+# restarts of the other units.
+CONDUCTOR_REJOIN_TIMEOUT = 600
+# ironic.conf options the conductor reloads on SIGHUP. A change to any other
+# option needs a restart.
+RELOADABLE_OPTIONS = [
+    ('DEFAULT', 'debug'),
+]
 
 # The IPMI HW type requires only ipmitool to function. This HW type
 # remains pretty much unchanged across OpenStack releases and *should*
@@ -156,6 +375,82 @@ _HW_TYPES_MAP = collections.OrderedDict([
 ])
 
 OPENSTACK_RELEASE_KEY = 'ironic-charm.openstack-release-version'
+# unitdata key holding the last image cache size computed by the charm.
+IMAGE_CACHE_SIZE_KEY = 'ironic-charm.image-cache-size'
+# unitdata key holding the disk usage of the image caches and deploy logs,
+# and the time it was measured.
+DIR_USAGE_KEY = 'ironic-charm.dir-usage'
+# unitdata key holding the context digest and content digest of every
+# config file, as they were when the file was last rendered.
+RENDER_DIGESTS_KEY = 'ironic-charm.render-digests'
+# unitdata key holding the state of the deploy logs cleanup timer.
+DEPLOY_LOGS_CLEANUP_KEY = 'ironic-charm.deploy-logs-cleanup'
+# unitdata key holding the state of a deferred conductor restart.
+RESTART_DEFERRED_KEY = 'ironic-charm.restart-deferred'
+# Flag set while a conductor restart is deferred.
+RESTART_DEFERRED_FLAG = 'ironic-conductor.restart-deferred'
+# unitdata key holding the time a conductor holding a restart token was
+# restarted.
+REJOIN_PENDING_KEY = 'ironic-charm.rejoin-pending'
+# Flag set while a restarted conductor holds its restart token, waiting to
+# rejoin the hash ring.
+REJOIN_PENDING_FLAG = 'ironic-conductor.rejoin-pending'
+
+DPKG_STATUS = "/var/lib/dpkg/status"
+
+# Values that are expensive to compute and are needed several times during
+# a hook. This lives for the duration of the hook, as every hook runs in a
+# new process.
+_HOOK_CACHE = {}
+
+
+def _dpkg_status_mtime():
+    try:
+        return os.stat(DPKG_STATUS).st_mtime
+    except OSError:
+        return None
+
+
+def cached_os_release(package):
+    """Memoized version of os_release().
+
+    The release is detected again whenever the dpkg database changes, so
+    package installs and upgrades done during the hook are taken into
+    account.
+
+    :param package: the package used for release detection.
+    :returns: the OpenStack release codename.
+    """
+    mtime = _dpkg_status_mtime()
+    key = ('os_release', package)
+    cached = _HOOK_CACHE.get(key, None)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    release = os_release(package, reset_cache=cached is not None)
+    _HOOK_CACHE[key] = (mtime, release)
+    return release
+
+
+def read_conf_options(path):
+    """Read the options set in an ini style config file.
+
+    :param path: the config file to read.
+    :returns: dict mapping (section, option) to the option value, or None if
+              the file can not be read or parsed.
+    """
+    parser = configparser.RawConfigParser(
+        strict=False, default_section=None)
+    parser.optionxform = str
+    try:
+        with open(path) as fd:
+            parser.read_file(fd)
+    except (OSError, configparser.Error):
+        return None
+    options = {}
+    for section in parser.sections():
+        for name, value in parser.items(section):
+            options[(section, name)] = value
+    return options
 
 
 # select the default release function
@@ -178,11 +473,51 @@ def temp_url_secret(args):
     return url_secret
 
 
+class IronicDatabaseRelationAdapter(DatabaseRelationAdapter):
+
+    def get_read_only_uri(self, port):
+        """Get the URI of the read-only endpoint of the database.
+
+        MySQL Router serves the secondaries of an InnoDB cluster on a port
+        of its own, next to the read-write port the relation points to.
+        The user info, path and query of the URI are kept, and the port is
+        replaced, or added if the URI has none.
+
+        :param port: the read-only port of the router.
+        :returns: the database URI, with the port replaced by the read-only
+                  one, or None if the relation is not complete or the port
+                  of the URI can not be replaced.
+        """
+        uri = self.uri
+        if not uri or not self.host:
+            return None
+        parts = urllib.parse.urlsplit(uri)
+        userinfo, sep, hostport = parts.netloc.rpartition("@")
+        if hostport.startswith("["):
+            address, _, current = hostport[1:].partition("]")
+            valid = not current or re.match(r"^:\d+$", current)
+        elif hostport.count(":") == 1:
+            address, _, current = hostport.partition(":")
+            valid = current.isdigit()
+        else:
+            # An unbracketed IPv6 address can only be told from a port when
+            # it is the address of the relation.
+            address = hostport
+            valid = ":" not in address or address == self.host
+        if not address or not valid:
+            # unix socket, or an address and port that can not be parsed
+            return None
+        if ":" in address:
+            address = "[%s]" % address
+        netloc = "%s%s%s:%s" % (userinfo, sep, address, port)
+        return urllib.parse.urlunsplit(parts._replace(netloc=netloc))
+
+
 class IronicAdapters(OpenStackRelationAdapters):
 
     relation_adapters = {
         'amqp': RabbitMQRelationAdapter,
-        'shared_db': DatabaseRelationAdapter,
+        'shared_db': IronicDatabaseRelationAdapter,
     }
 
 
@@ -230,12 +565,28 @@ class IronicConductorCharm(charms_openstack.charm.OpenStackCharm):
         "enabled-deploy-interfaces",
     ]
 
+    @profiling.timed('charm_init')
     def __init__(self, **kw):
         super().__init__(**kw)
         self.pxe_config = controller_utils.get_pxe_config_class(
-            self.config, os_release(self.release_pkg))
+            self.config, cached_os_release(self.release_pkg))
         self._setup_pxe_config(self.pxe_config)
         self._setup_power_adapter_config()
+        self._setup_conductor_tuning()
+        self._setup_ipmi_tuning()
+        self._setup_redfish_tuning()
+        self._setup_database_tuning()
+        self._setup_messaging()
+        self._setup_rpc_transport()
+        self._setup_token_cache()
+        self._setup_hash_ring()
+        self._setup_image_cache()
+        self._setup_image_conversion()
+        self._setup_cleaning()
+        self._setup_deploy_logs_retention()
+        self._setup_http_boot_profile()
+        self._setup_http_boot()
+        self._setup_tftp_config()
         self._configure_defaults()
         if "neutron" in self.enabled_network_interfaces:
             self.mandatory_config.extend([
@@ -251,7 +602,7 @@ class IronicConductorCharm(charms_openstack.charm.OpenStackCharm):
             self.config["default-deploy-interface"] = DEFAULT_DEPLOY_IFACE
 
     def _get_hw_type_map(self):
-        release = os_release(self.release_pkg)
+        release = cached_os_release(self.release_pkg)
         supported = list(_HW_TYPES_MAP.keys())
         latest = supported[-1]
         hw_type_map = _HW_TYPES_MAP.get(
@@ -268,6 +619,17 @@ class IronicConductorCharm(charms_openstack.charm.OpenStackCharm):
         return list(set(pkgs))
 
     def _get_hardware_types_config(self):
+        key = (
+            'hardware_type_cfg',
+            cached_os_release(self.release_pkg),
+            tuple(self.enabled_hw_types),
+            bool(self.config.get('use-ipxe', None)),
+            self.uefi_http_boot)
+        if key not in _HOOK_CACHE:
+            _HOOK_CACHE[key] = self._compute_hardware_types_config()
+        return deepcopy(_HOOK_CACHE[key])
+
+    def _compute_hardware_types_config(self):
         hw_type_map = self._get_hw_type_map()
         configs = {}
         for hw_type in self.enabled_hw_types:
@@ -289,6 +651,10 @@ class IronicConductorCharm(charms_openstack.charm.OpenStackCharm):
 
         if self.config.get('use-ipxe', None):
             configs["enabled_boot_interfaces"].append('ipxe')
+        if self.uefi_http_boot:
+            configs["enabled_boot_interfaces"].append('http')
+            if self.config.get('use-ipxe', None):
+                configs["enabled_boot_interfaces"].append('http-ipxe')
 
         # append the noop interfaces at the end
         for noop in _NOOP_INTERFACES:
@@ -302,6 +668,43 @@ class IronicConductorCharm(charms_openstack.charm.OpenStackCharm):
                 configs[opt] = ""
         return configs
 
+    @property
+    def uefi_http_boot(self):
+        """Whether the UEFI HTTP boot interfaces are enabled.
+
+        They are only enabled on releases that support them.
+        """
+        if not self.config.get('uefi-http-boot', None):
+            return False
+        release = cached_os_release(self.release_pkg)
+        return (CompareOpenStackReleases(release) >=
+                UEFI_HTTP_BOOT_MIN_RELEASE)
+
+    def _setup_http_boot(self):
+        """Set up UEFI HTTP boot, with a fallback to PXE.
+
+        The http and http-ipxe boot interfaces are only enabled, so nodes
+        not setting a boot interface keep booting over PXE, and nodes
+        booting in UEFI mode can be switched to HTTP boot one by one. HTTP
+        boot is made the default boot interface only if the operator sets
+        uefi-http-boot-default, as it fails on nodes booting in legacy BIOS
+        mode.
+        """
+        http_boot = {}
+        if self.config.get('uefi-http-boot', None):
+            if not self.uefi_http_boot:
+                hookenv.log(
+                    "uefi-http-boot needs OpenStack %s or later, nodes will "
+                    "keep booting over PXE" % UEFI_HTTP_BOOT_MIN_RELEASE,
+                    level=hookenv.WARNING)
+            else:
+                http_boot['enabled'] = True
+                if self.config.get('uefi-http-boot-default', None):
+                    http_boot['default_boot_interface'] = (
+                        'http-ipxe' if self.config.get('use-ipxe', None)
+                        else 'http')
+        self.config["http_boot"] = http_boot
+
     def _setup_power_adapter_config(self):
         pkgs = self._get_power_adapter_packages()
         config = self._get_hardware_types_config()
@@ -309,6 +712,575 @@ class IronicConductorCharm(charms_openstack.charm.OpenStackCharm):
         self.packages = list(set(self.packages))
         self.config["hardware_type_cfg"] = config
 
+    def _get_auto_conductor_tuning(self, configs):
+        """Compute worker pool sizes from the resources of this unit.
+
+        Power sync workers scale with the number of CPUs, periodic task
+        workers additionally scale with the number of enabled hardware
+        types, as each of them adds its own periodic tasks. The worker pool
+        is sized so that both can run at the same time while leaving room
+        for RPC requests. Values already present in configs are kept.
+
+        :param configs: the explicitly configured [conductor] options.
+        :returns: dict of [conductor] options.
+        """
+        cpus = os.cpu_count() or 1
+        hw_types = self._get_hw_type_map()
+        num_hw_types = len(
+            [i for i in self.enabled_hw_types if i in hw_types]) or 1
+        tuning = {
+            'sync_power_state_workers': min(max(8, cpus * 2), 64),
+            'periodic_max_workers': min(max(8, cpus + 4 * num_hw_types), 64),
+        }
+        tuning.update(configs)
+        workers = (tuning['sync_power_state_workers'] +
+                   tuning['periodic_max_workers'])
+        tuning.setdefault('workers_pool_size', max(100, workers * 4))
+        return tuning
+
+    def _get_conductor_tuning_config(self):
+        configs = {}
+        for charm_opt, ironic_opt in _CONDUCTOR_TUNING_OPTIONS.items():
+            value = self.config.get(charm_opt, None)
+            if value:
+                configs[ironic_opt] = value
+        if self.config.get('conductor-tuning-mode', None) == 'auto':
+            configs = self._get_auto_conductor_tuning(configs)
+        return configs
+
+    def _setup_conductor_tuning(self):
+        self.config["conductor_tuning"] = self._get_conductor_tuning_config()
+
+    def _get_ipmi_tuning_config(self):
+        configs = {}
+        for charm_opt, ironic_opt in _IPMI_TUNING_OPTIONS.items():
+            value = self.config.get(charm_opt, None)
+            # booleans are rendered even when disabled
+            if isinstance(value, bool) or value:
+                configs[ironic_opt] = value
+        return configs
+
+    def _setup_ipmi_tuning(self):
+        self.config["ipmi_tuning"] = self._get_ipmi_tuning_config()
+
+    def _get_redfish_tuning_config(self):
+        if not any(i in _REDFISH_HW_TYPES for i in self.enabled_hw_types):
+            return {}
+        configs = deepcopy(_REDFISH_TUNING_DEFAULTS)
+        for charm_opt, ironic_opt in _REDFISH_TUNING_OPTIONS.items():
+            value = self.config.get(charm_opt, None)
+            if value:
+                configs[ironic_opt] = value
+        return configs
+
+    def _setup_redfish_tuning(self):
+        self.config["redfish_tuning"] = self._get_redfish_tuning_config()
+
+    def _get_database_tuning_config(self):
+        """Size the database connection pool of the conductor.
+
+        The pool holds a connection for every sync power state and periodic
+        task worker, and may overflow by as many connections for the RPC
+        requests handled meanwhile. Explicitly configured values are kept.
+
+        :returns: dict of [database] options.
+        """
+        conductor = deepcopy(_CONDUCTOR_TUNING_DEFAULTS)
+        conductor.update(self.config["conductor_tuning"])
+        workers = (conductor['sync_power_state_workers'] +
+                   conductor['periodic_max_workers'])
+        pool_size = min(workers, MAX_DATABASE_POOL_SIZE)
+        configs = {
+            'max_pool_size': pool_size,
+            'max_overflow': pool_size,
+        }
+        for charm_opt, ironic_opt in _DATABASE_TUNING_OPTIONS.items():
+            value = self.config.get(charm_opt, None)
+            if value:
+                configs[ironic_opt] = value
+        return configs
+
+    def _setup_database_tuning(self):
+        self.config["database_tuning"] = self._get_database_tuning_config()
+
+    def _get_database_max_connections(self):
+        """Get the max_connections published on the shared-db relation.
+
+        :returns: the maximum number of connections of the database server,
+                  or None if it is not known.
+        """
+        for rid in hookenv.relation_ids('shared-db'):
+            for unit in hookenv.related_units(rid):
+                value = hookenv.relation_get(
+                    'max_connections', rid=rid, unit=unit)
+                try:
+                    return int(value)
+                except (TypeError, ValueError):
+                    continue
+        return None
+
+    def _get_database_tuning_warnings(self):
+        """Check the connection pools of the conductors against the server.
+
+        :returns: list of messages describing the issues found.
+        """
+        max_connections = self._get_database_max_connections()
+        if not max_connections:
+            return []
+        tuning = deepcopy(_DATABASE_POOL_DEFAULTS)
+        tuning.update(self.config["database_tuning"])
+        per_unit = tuning['max_pool_size'] + tuning['max_overflow']
+        units = 1
+        for rid in hookenv.relation_ids(PEER_RELATION):
+            units += len(hookenv.related_units(rid))
+        if per_unit * units <= max_connections:
+            return []
+        return [
+            '%d units may open up to %d connections each, more than the '
+            'max_connections of the database (%d)' % (
+                units, per_unit, max_connections)]
+
+    def _get_ipmi_tuning_warnings(self):
+        """Check the IPMI and power sync settings against each other.
+
+        :returns: list of messages describing the inconsistent settings.
+        """
+        ipmi = deepcopy(_IPMI_TUNING_DEFAULTS)
+        ipmi.update(self._get_ipmi_tuning_config())
+        conductor = deepcopy(_CONDUCTOR_TUNING_DEFAULTS)
+        conductor.update(self._get_conductor_tuning_config())
+        warnings = []
+        if ipmi['min_command_interval'] >= ipmi['command_retry_timeout']:
+            warnings.append(
+                'ipmi-min-command-interval (%s) is not shorter than '
+                'ipmi-command-retry-timeout (%s), IPMI commands are never '
+                'retried' % (
+                    ipmi['min_command_interval'],
+                    ipmi['command_retry_timeout']))
+        if (ipmi['command_retry_timeout'] >
+                conductor['sync_power_state_interval']):
+            warnings.append(
+                'ipmi-command-retry-timeout (%s) is longer than '
+                'sync-power-state-interval (%s), unresponsive BMCs delay '
+                'the next power sync' % (
+                    ipmi['command_retry_timeout'],
+                    conductor['sync_power_state_interval']))
+        if not ipmi['kill_on_timeout']:
+            warnings.append(
+                'ipmi-kill-on-timeout is disabled, timed out ipmitool '
+                'processes pile up')
+        return warnings
+
+    def _get_conductor_group(self):
+        group = self.config.get('conductor-group', None) or ""
+        if (not group and
+                self.config.get('conductor-group-from-availability-zone')):
+            zone = os.environ.get('JUJU_AVAILABILITY_ZONE', None) or ""
+            # Availability zone names may hold characters Ironic does not
+            # accept in conductor group names.
+            group = re.sub(r'[^a-zA-Z0-9_\-\.]', '-', zone)
+        # Ironic stores conductor groups in lower case.
+        return group.lower()
+
+    def _setup_hash_ring(self):
+        hash_ring = {}
+        group = self._get_conductor_group()
+        if group:
+            hash_ring['conductor_group'] = group
+        for charm_opt, ironic_opt in _HASH_RING_OPTIONS.items():
+            value = self.config.get(charm_opt, None) or 0
+            if value > 0:
+                hash_ring[ironic_opt] = value
+        self.config["hash_ring"] = hash_ring
+
+    @property
+    def image_cache_dirs(self):
+        return [
+            self.pxe_config.TFTP_MASTER_PATH,
+            self.pxe_config.INSTANCE_MASTER_PATH,
+        ]
+
+    def _get_dirs_usage(self, paths, max_age=DIR_USAGE_MAX_AGE):
+        """Get the disk usage of directories.
+
+        Walking the image caches and the deploy logs takes a while, so the
+        usage is kept in unitdata, and a directory is only walked again once
+        its usage was measured more than max_age seconds ago.
+
+        :param paths: the directories to measure.
+        :param max_age: the age, in seconds, of the usage that is reused.
+        :returns: dict mapping the paths to their usage in bytes.
+        """
+        db = unitdata.kv()
+        measured = db.get(DIR_USAGE_KEY, {})
+        now = time.time()
+        usage = {}
+        stale = False
+        for path in paths:
+            entry = measured.get(path, None)
+            if entry is None or now - entry['time'] >= max_age:
+                entry = {
+                    'time': now,
+                    'usage': controller_utils.get_dir_usage(path),
+                }
+                measured[path] = entry
+                stale = True
+            usage[path] = entry['usage']
+        if stale:
+            db.set(DIR_USAGE_KEY, measured)
+        return usage
+
+    def _get_image_cache_usage(self):
+        return sum(self._get_dirs_usage(self.image_cache_dirs).values())
+
+    def _get_auto_image_cache_size(self):
+        """Size the master image caches from the available disk space.
+
+        Ironic applies image_cache_size to every cache separately, so the
+        space the caches may use is split between them. Images already in
+        the caches count as available, as ironic will evict them if needed.
+        The filesystems holding the TFTP and HTTP roots are taken into
+        account, as deploy kernels and ramdisks are linked or copied from
+        the cache into them.
+
+        The size is rounded down to a whole GiB, and the previously
+        computed size is kept as long as it is within
+        IMAGE_CACHE_SIZE_TOLERANCE_PERCENT of the new one. It is computed
+        once per hook.
+
+        :returns: the size of each cache in MiB.
+        """
+        key = ('image_cache_size', )
+        if key in _HOOK_CACHE:
+            return _HOOK_CACHE[key]
+        percent = (self.config.get('image-cache-free-space-percent', None) or
+                   DEFAULT_IMAGE_CACHE_FREE_SPACE_PERCENT)
+        paths = [self.pxe_config.TFTP_ROOT, self.pxe_config.HTTP_ROOT]
+        paths.extend(self.image_cache_dirs)
+        free = min([controller_utils.get_free_space(i) for i in paths])
+        available = (free + self._get_image_cache_usage()) * percent / 100
+        size = int(available / len(self.image_cache_dirs) / MIB)
+        if size > 1024:
+            size = size // 1024 * 1024
+        size = max(size, 1)
+
+        db = unitdata.kv()
+        previous = db.get(IMAGE_CACHE_SIZE_KEY, None)
+        if previous and (abs(size - previous) * 100 <=
+                         previous * IMAGE_CACHE_SIZE_TOLERANCE_PERCENT):
+            size = previous
+        else:
+            db.set(IMAGE_CACHE_SIZE_KEY, size)
+        _HOOK_CACHE[key] = size
+        return size
+
+    def _setup_image_cache(self):
+        # The size computed from the free disk space is only updated when
+        # the configs are rendered, see update_image_cache_size().
+        cache_size = (self.config.get('image-cache-size', None) or
+                      unitdata.kv().get(IMAGE_CACHE_SIZE_KEY, None))
+        self.config["image_cache"] = {
+            'size': cache_size,
+            'ttl': self.config.get(
+                'image-cache-ttl', DEFAULT_IMAGE_CACHE_TTL),
+            'tftp_master_path': self.pxe_config.TFTP_MASTER_PATH,
+            'instance_master_path': self.pxe_config.INSTANCE_MASTER_PATH,
+        }
+
+    def update_image_cache_size(self):
+        """Size the image caches from the free disk space, unless set."""
+        if not self.config.get('image-cache-size', None):
+            self.config["image_cache"]["size"] = (
+                self._get_auto_image_cache_size())
+
+    def _get_image_conversion_memory_budget(self):
+        """Return the memory, in MiB, concurrent conversions may use."""
+        ram_mib = int(host.get_total_ram() / MIB)
+        return ram_mib * IMAGE_CONVERSION_RAM_PERCENT // 100
+
+    def _get_auto_image_download_concurrency(self, memory_limit):
+        """Compute how many images may be converted at the same time.
+
+        qemu-img convert is CPU bound, so there are never more conversions
+        than CPUs, and they all fit in the memory budget of the unit even if
+        each of them hits the memory limit.
+
+        :param memory_limit: the memory limit of qemu-img convert, in MiB.
+        :returns: the number of concurrent image downloads and conversions.
+        """
+        cpus = os.cpu_count() or 1
+        budget = self._get_image_conversion_memory_budget()
+        return max(min(DEFAULT_IMAGE_DOWNLOAD_CONCURRENCY, cpus,
+                       budget // memory_limit), 1)
+
+    def _get_image_conversion_config(self):
+        configs = {}
+        for charm_opt, ironic_opt in (
+                ('force-raw-images', 'force_raw_images'),
+                ('stream-raw-images', 'stream_raw_images')):
+            value = self.config.get(charm_opt, None)
+            if value is not None:
+                configs[ironic_opt] = value
+        memory_limit = self.config.get('image-convert-memory-limit', None)
+        if memory_limit:
+            configs['image_convert_memory_limit'] = memory_limit
+        concurrency = self.config.get('image-download-concurrency', None)
+        if concurrency:
+            configs['image_download_concurrency'] = concurrency
+        elif (configs.get('force_raw_images') and
+                self.config.get('conductor-tuning-mode', None) == 'auto'):
+            configs['image_download_concurrency'] = (
+                self._get_auto_image_download_concurrency(
+                    memory_limit or DEFAULT_IMAGE_CONVERT_MEMORY_LIMIT))
+        return configs
+
+    def _setup_image_conversion(self):
+        self.config["image_conversion"] = self._get_image_conversion_config()
+
+    def _get_messaging_config(self):
+        profile = self.config.get('messaging-profile', None) or 'default'
+        tuning = deepcopy(
+            _MESSAGING_PROFILES.get(profile, _MESSAGING_PROFILES['default']))
+        configs = {'DEFAULT': {}, 'oslo_messaging_rabbit': {}}
+        for charm_opt, (section, ironic_opt) in _MESSAGING_OPTIONS.items():
+            value = self.config.get(charm_opt, None)
+            if value:
+                tuning[ironic_opt] = value
+            if ironic_opt in tuning:
+                configs[section][ironic_opt] = tuning[ironic_opt]
+        return configs
+
+    def _setup_messaging(self):
+        self.config["messaging_tuning"] = self._get_messaging_config()
+
+    def _setup_rpc_transport(self):
+        json_rpc = {}
+        if self.config.get('rpc-transport', None) == 'json-rpc':
+            json_rpc['port'] = (
+                self.config.get('json-rpc-port', None) or
+                DEFAULT_JSON_RPC_PORT)
+        self.config["json_rpc"] = json_rpc
+
+    def publish_rpc_transport(self):
+        """Publish the RPC transport of the conductor to ironic-api.
+
+        With JSON-RPC, ironic-api needs the port the conductors listen on.
+        It calls each conductor at its [DEFAULT] host, the internal address
+        of the unit, and the endpoint it derives from it is published for
+        reference.
+        """
+        json_rpc = self.config["json_rpc"]
+        settings = {
+            'rpc-transport': 'oslo',
+            'json-rpc-port': None,
+            'json-rpc-endpoint': None,
+        }
+        if json_rpc:
+            host = self.conductor_host
+            if ":" in host:
+                host = "[%s]" % host
+            settings = {
+                'rpc-transport': 'json-rpc',
+                'json-rpc-port': json_rpc['port'],
+                'json-rpc-endpoint': 'http://%s:%s' % (
+                    host, json_rpc['port']),
+            }
+        for rid in hookenv.relation_ids(IRONIC_API_RELATION):
+            hookenv.relation_set(relation_id=rid, relation_settings=settings)
+
+    def _get_memcache_servers(self):
+        """Get the memcached servers caching the keystone tokens.
+
+        :returns: sorted list of servers, as host:port strings.
+        """
+        token_cache = self.config.get('token-cache', None) or 'none'
+        if token_cache == 'local':
+            return [LOCAL_MEMCACHE_SERVER]
+        if token_cache != 'relation':
+            return []
+        servers = []
+        for rid in hookenv.relation_ids(MEMCACHE_RELATION):
+            for unit in hookenv.related_units(rid):
+                host_addr = hookenv.relation_get('host', rid=rid, unit=unit)
+                if not host_addr:
+                    continue
+                port = (hookenv.relation_get('port', rid=rid, unit=unit) or
+                        DEFAULT_MEMCACHE_PORT)
+                if ":" in host_addr:
+                    host_addr = "inet6:[%s]" % host_addr
+                servers.append("%s:%s" % (host_addr, port))
+        return sorted(servers)
+
+    def _setup_token_cache(self):
+        servers = self._get_memcache_servers()
+        # use_memcache and memcache_url are read by the keystone_authtoken
+        # template part.
+        self.config["use_memcache"] = bool(servers)
+        self.config["memcache_url"] = ",".join(servers)
+        if self.config.get('token-cache', None) == 'local':
+            self.packages = list(set(self.packages + [MEMCACHED]))
+            self.services = self.services + [MEMCACHED]
+
+    def configure_token_cache(self):
+        """Install and start the local memcached, if it is used."""
+        if self.config.get('token-cache', None) != 'local':
+            return
+        missing = fetch.filter_installed_packages([MEMCACHED])
+        if missing:
+            fetch.apt_install(missing, fatal=True)
+        if not is_unit_paused_set():
+            host.service_resume(MEMCACHED)
+
+    def _get_cleaning_config(self):
+        profile = self.config.get('cleaning-profile', None) or 'default'
+        configs = deepcopy(
+            _CLEANING_PROFILES.get(profile, _CLEANING_PROFILES['default']))
+        for charm_opt, ironic_opt in _CLEANING_OPTIONS.items():
+            value = self.config.get(charm_opt, None)
+            if value is None or value < 0:
+                continue
+            if ironic_opt == 'disk_erasure_concurrency' and not value:
+                continue
+            configs[ironic_opt] = value
+        continue_on_fail = self.config.get(
+            'continue-if-disk-secure-erase-fails', None)
+        if continue_on_fail is not None:
+            configs['continue_if_disk_secure_erase_fails'] = continue_on_fail
+        if self.config.get('disable-secure-erase', None):
+            # disable-secure-erase turns shredding off, whatever the profile.
+            configs.pop('shred_random_overwrite_iterations', None)
+            configs.pop('shred_final_overwrite_with_zeros', None)
+        return configs
+
+    def _setup_cleaning(self):
+        self.config["cleaning"] = self._get_cleaning_config()
+
+    @property
+    def deploy_logs_local(self):
+        return (self.config.get('deploy-logs-storage-backend', None) ==
+                'local')
+
+    def _setup_deploy_logs_retention(self):
+        retention = {}
+        if self.deploy_logs_local:
+            retention = {
+                'path': self.config.get('deploy-logs-local-path', None),
+                'max_age_minutes': (
+                    self.config.get('deploy-logs-max-age', None) or 0) * 1440,
+                'max_size_bytes': (
+                    self.config.get('deploy-logs-max-size', None) or 0) * MIB,
+                'compress_after_minutes': (
+                    self.config.get('deploy-logs-compress-after',
+                                    None) or 0) * 60,
+            }
+            if not any(v for k, v in retention.items() if k != 'path'):
+                # no retention policy was set
+                retention = {}
+        self.config["deploy_logs_retention"] = retention
+        if not retention:
+            return
+        # The deploy logs cleanup timer is (re)started by
+        # configure_deploy_logs_retention().
+        self.restart_map = dict(self.restart_map)
+        self.restart_map.update({
+            DEPLOY_LOGS_CLEANUP_SCRIPT: [],
+            DEPLOY_LOGS_CLEANUP_SERVICE: [],
+            DEPLOY_LOGS_CLEANUP_TIMER: [],
+        })
+        self.permission_override_map[DEPLOY_LOGS_CLEANUP_SCRIPT] = 0o755
+
+    def configure_deploy_logs_retention(self):
+        """Enable the deploy logs cleanup timer if a retention policy is set.
+
+        The timer and its service are only rendered once a policy is set,
+        and the timer is disabled again when the policy is unset. systemd
+        is only reloaded when the unit files changed, and the timer is only
+        (re)started or stopped when its state changed since the last hook.
+        """
+        if not os.path.isfile(DEPLOY_LOGS_CLEANUP_TIMER):
+            # not rendered yet
+            return
+        state = {
+            'enabled': bool(self.config["deploy_logs_retention"]),
+            'units': [
+                controller_utils.file_digest(i)
+                for i in (DEPLOY_LOGS_CLEANUP_SERVICE,
+                          DEPLOY_LOGS_CLEANUP_TIMER)],
+        }
+        db = unitdata.kv()
+        current = db.get(DEPLOY_LOGS_CLEANUP_KEY, {})
+        if current == state:
+            return
+        if current.get('units') != state['units']:
+            subprocess.check_call(['systemctl', 'daemon-reload'])
+        timer = DEPLOY_LOGS_CLEANUP + ".timer"
+        if state['enabled']:
+            subprocess.check_call(['systemctl', 'enable', timer])
+            subprocess.check_call(['systemctl', 'restart', timer])
+        else:
+            subprocess.check_call(['systemctl', 'disable', '--now', timer])
+        db.set(DEPLOY_LOGS_CLEANUP_KEY, state)
+
+    def _get_mass_boot_nginx_config(self):
+        """Size the nginx serving /httpboot for many simultaneous boots.
+
+        Every active download may hold up to two 1 MiB output buffers, so
+        the connection limit is sized to keep those buffers within a
+        quarter of the RAM of the unit. Files larger than 1/16th of the RAM
+        are read with O_DIRECT, so a single large image does not evict the
+        kernels and ramdisks most nodes are fetching from the page cache.
+        """
+        cpus = os.cpu_count() or 1
+        ram_mib = int(host.get_total_ram() / MIB)
+        worker_connections = min(max(ram_mib // 8 // cpus, 1024), 8192)
+        return {
+            'worker_connections': worker_connections,
+            'worker_rlimit_nofile': worker_connections * 2,
+            'open_file_cache_max': min(max(ram_mib // 2, 1000), 20000),
+            'directio': "%dm" % max(ram_mib // 16, 64),
+            'sendfile_max_chunk': "2m",
+            'output_buffers': "2 1m",
+        }
+
+    def _setup_http_boot_profile(self):
+        nginx_cfg = {}
+        if self.config.get('http-boot-profile', None) == 'mass-boot':
+            nginx_cfg = self._get_mass_boot_nginx_config()
+        self.config["nginx_tuning"] = nginx_cfg
+
+    @property
+    def tftp_refuse_options(self):
+        return (self.config.get('tftp-refuse-options', None) or "").split()
+
+    def _get_tftp_options(self):
+        profile = self.config.get('tftp-boot-profile', None) or 'default'
+        tuning = deepcopy(
+            _TFTP_PROFILES.get(profile, _TFTP_PROFILES['default']))
+        verbosity = self.config.get('tftp-verbosity', None)
+        if verbosity is not None and verbosity >= 0:
+            tuning['verbosity'] = min(verbosity, MAX_TFTP_VERBOSITY)
+        retransmit = self.config.get('tftp-retransmit-timeout', None) or 0
+        if retransmit > 0:
+            tuning['retransmit'] = retransmit
+
+        opts = []
+        ip_version = self.config.get('tftp-ip-version', None) or "4"
+        if ip_version in ("4", "6"):
+            opts.append("-%s" % ip_version)
+        opts.extend(["-v"] * tuning['verbosity'])
+        opts.extend(["--map-file", "%s/map-file" % self.config["tftpboot"]])
+        block_size = self.config.get('max-tftp-block-size', None) or 0
+        if block_size:
+            opts.extend(["--blocksize", str(block_size)])
+        if tuning['retransmit']:
+            opts.extend(["--retransmit", str(tuning['retransmit'])])
+        for option in self.tftp_refuse_options:
+            opts.extend(["--refuse", option])
+        return " ".join(opts)
+
+    def _setup_tftp_config(self):
+        self.config["tftp_options"] = self._get_tftp_options()
+
     def _setup_pxe_config(self, cfg):
         self.packages.extend(cfg.determine_packages())
         self.packages = list(set(self.packages))
@@ -323,6 +1295,7 @@ class IronicConductorCharm(charms_openstack.charm.OpenStackCharm):
             self.services.append(
                 cfg.HTTPD_SERVICE_NAME)
 
+    @profiling.timed('install')
     def install(self):
         self.configure_source()
         super().install()
@@ -330,6 +1303,300 @@ class IronicConductorCharm(charms_openstack.charm.OpenStackCharm):
         self.pxe_config._copy_resources()
         self.assess_status()
 
+    def _get_templates_digest(self):
+        key = ('templates_digest', )
+        if key not in _HOOK_CACHE:
+            digest = hashlib.sha256()
+            templates_dir = os.path.join(hookenv.charm_dir(), 'templates')
+            for root, dirs, files in os.walk(templates_dir):
+                dirs.sort()
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    digest.update(path.encode())
+                    digest.update(
+                        controller_utils.file_digest(path).encode())
+            _HOOK_CACHE[key] = digest.hexdigest()
+        return _HOOK_CACHE[key]
+
+    def _get_adapters_context(self, interfaces):
+        """Read every value the templates can read from the adapters.
+
+        The templates are rendered with an adapters_class instance built
+        from the interfaces. Every public attribute and property of its
+        adapters, including the config properties of the options adapter,
+        is read the way the templates read it. Methods are left out, as
+        they compute their results from those values.
+
+        :param interfaces: the interfaces passed to render_with_interfaces.
+        :returns: dict mapping the adapter names to their values.
+        """
+        # config properties are served by ConfigurationAdapter.__getattr__,
+        # so dir() does not list them.
+        config_properties = getattr(
+            charms_openstack.adapters, '_custom_config_properties', {})
+        context = {}
+        adapters_instance = self.adapters_class(
+            interfaces, charm_instance=self)
+        for name, adapter in adapters_instance:
+            names = set(dir(adapter))
+            if name == 'options':
+                names.update(config_properties)
+            values = {}
+            for attr in names:
+                if attr.startswith('_'):
+                    continue
+                try:
+                    value = getattr(adapter, attr)
+                except Exception as err:
+                    value = "failed: %s" % type(err).__name__
+                if not callable(value):
+                    values[attr] = value
+            context[name] = values
+        return context
+
+    def _get_render_context_digest(self, interfaces):
+        """Compute a digest of everything the rendered configs depend on.
+
+        :param interfaces: the interfaces passed to render_with_interfaces.
+        :returns: the sha256 hex digest of the render context.
+        """
+        context = {
+            'release': self.release,
+            'templates': self._get_templates_digest(),
+            'adapters': self._get_adapters_context(interfaces),
+        }
+        # Objects, such as the interfaces behind the relation adapters, are
+        # not rendered as such, only their type is kept, so their address
+        # does not change the digest on every hook.
+        encoded = json.dumps(context, sort_keys=True,
+                             default=lambda obj: type(obj).__name__).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    @profiling.timed('render_with_interfaces')
+    def render_with_interfaces(self, interfaces, configs=None):
+        """Render the configs whose render context changed.
+
+        A config is rendered again if the render context changed since it
+        was last rendered, or if the file was changed or removed since.
+        When no config needs rendering, neither the templates are rendered
+        nor the services restarted.
+        """
+        if configs is None:
+            configs = list(self.restart_map.keys())
+        self.update_image_cache_size()
+        digest = self._get_render_context_digest(interfaces)
+        db = unitdata.kv()
+        rendered = db.get(RENDER_DIGESTS_KEY, {})
+        stale = []
+        for conf in configs:
+            entry = rendered.get(conf, {})
+            if (entry.get('context') != digest or
+                    not os.path.isfile(conf) or
+                    entry.get('file') != controller_utils.file_digest(conf)):
+                stale.append(conf)
+        if not stale:
+            hookenv.log("render context unchanged, not rendering configs",
+                        level=hookenv.DEBUG)
+            return
+
+        super().render_with_interfaces(interfaces, configs=stale)
+        for conf in stale:
+            if os.path.isfile(conf):
+                rendered[conf] = {
+                    'context': digest,
+                    'file': controller_utils.file_digest(conf),
+                }
+        db.set(RENDER_DIGESTS_KEY, rendered)
+
+    @contextlib.contextmanager
+    def restart_on_change(self):
+        """Restart the services whose config files changed.
+
+        Unlike the default implementation, ironic-conductor is reloaded with
+        SIGHUP when only options it can reload changed, and is restarted
+        with restart_conductor(), which defers the restart while the
+        conductor holds node locks.
+        """
+        checksums = {path: host.path_hash(path)
+                     for path in self.full_restart_map.keys()}
+        conf_before = read_conf_options(IRONIC_CONF)
+        yield
+        changed = []
+        restarts = []
+        for path, services in self.full_restart_map.items():
+            if host.path_hash(path) != checksums[path]:
+                changed.append(path)
+                restarts += services
+        services_list = list(collections.OrderedDict.fromkeys(restarts))
+        if not services_list or is_unit_paused_set():
+            return
+
+        for service_name in services_list:
+            if service_name != 'ironic-conductor':
+                host.service_restart(service_name)
+        if 'ironic-conductor' not in services_list:
+            return
+        conductor_files = [
+            path for path in changed
+            if 'ironic-conductor' in self.full_restart_map[path]]
+        if (conductor_files == [IRONIC_CONF] and
+                self._only_reloadable_changed(
+                    conf_before, read_conf_options(IRONIC_CONF))):
+            self.reload_conductor()
+        else:
+            self.restart_conductor()
+
+    def _only_reloadable_changed(self, before, after):
+        if before is None or after is None:
+            return False
+        changed = set(
+            key for key in set(before) | set(after)
+            if before.get(key) != after.get(key))
+        return changed.issubset(RELOADABLE_OPTIONS)
+
+    def reload_conductor(self):
+        """Make ironic-conductor reload its mutable config options."""
+        hookenv.log("only reloadable options changed, sending SIGHUP to "
+                    "ironic-conductor", level=hookenv.INFO)
+        subprocess.check_call([
+            'systemctl', 'kill', '--signal=HUP', '--kill-who=main',
+            'ironic-conductor'])
+
+    @property
+    def conductor_host(self):
+        """The host name the conductor uses to reserve nodes."""
+        if self.config["json_rpc"]:
+            # ironic-api calls the conductor at its [DEFAULT] host with
+            # JSON-RPC, so ironic.conf sets it to the internal address.
+            return ch_ip.get_relation_ip("internal")
+        # ironic.conf does not set [DEFAULT] host, so the conductor
+        # uses the Ironic default.
+        return socket.getfqdn()
+
+    def _get_keystone_session(self):
+        keystone = reactive.endpoint_from_flag(
+            'identity-credentials.available')
+        if keystone is None:
+            return None
+        return api_utils.create_keystone_session(keystone)
+
+    def _get_conductor_reservations(self):
+        if not reactive.is_flag_set('ironic-api.available'):
+            # the Ironic API is not up yet
+            return 0
+        try:
+            session = self._get_keystone_session()
+            if session is None:
+                return 0
+            return len(api_utils.get_reserved_nodes(
+                session, self.conductor_host))
+        except Exception as err:
+            hookenv.log("failed to get the nodes locked by the conductor, "
+                        "not deferring its restart: %s" % err,
+                        level=hookenv.WARNING)
+            return 0
+
+    def _conductor_rejoined(self):
+        try:
+            session = self._get_keystone_session()
+            if session is None:
+                return True
+            return api_utils.is_conductor_alive(
+                session, self.conductor_host)
+        except Exception as err:
+            hookenv.log("failed to check whether the conductor rejoined the "
+                        "hash ring, releasing the restart token: %s" % err,
+                        level=hookenv.WARNING)
+            return True
+
+    def _defer_conductor_restart(self, since, reservations):
+        unitdata.kv().set(RESTART_DEFERRED_KEY, {
+            "since": since,
+            "reservations": reservations,
+        })
+        reactive.set_flag(RESTART_DEFERRED_FLAG)
+        return False
+
+    def restart_conductor(self):
+        """Restart ironic-conductor once it holds no node locks.
+
+        The restart is deferred while the conductor holds locks, so that
+        deployments and cleanings in progress are not interrupted, unless
+        the restart has been deferred for longer than
+        conductor-restart-max-defer minutes. When restart-batch-size is
+        set, the restart also waits for the leader to grant this unit a
+        restart token, which is given back by release_restart_token() in a
+        later hook. A deferred restart is retried on every hook until it
+        happens.
+
+        :returns: True if the conductor was restarted, False if the restart
+                  was deferred.
+        """
+        deferred = unitdata.kv().get(RESTART_DEFERRED_KEY)
+        now = time.time()
+        since = deferred["since"] if deferred else now
+        if self.config.get('defer-conductor-restart'):
+            max_defer = self.config.get('conductor-restart-max-defer') or 0
+            reservations = self._get_conductor_reservations()
+            if reservations and max_defer and now - since >= max_defer * 60:
+                hookenv.log("conductor restart deferred for more than %d "
+                            "minutes, restarting with %d nodes locked" % (
+                                max_defer, reservations),
+                            level=hookenv.WARNING)
+            elif reservations:
+                hookenv.log("deferring conductor restart, %d nodes "
+                            "locked" % reservations, level=hookenv.INFO)
+                return self._defer_conductor_restart(since, reservations)
+
+        batch_size = self.config.get('restart-batch-size') or 0
+        if batch_size > 0 and not rolling_restart.acquire_token(batch_size):
+            hookenv.log("deferring conductor restart until the leader grants "
+                        "a restart token", level=hookenv.INFO)
+            return self._defer_conductor_restart(since, 0)
+
+        host.service_restart('ironic-conductor')
+        unitdata.kv().unset(RESTART_DEFERRED_KEY)
+        reactive.clear_flag(RESTART_DEFERRED_FLAG)
+        if batch_size > 0:
+            unitdata.kv().set(REJOIN_PENDING_KEY, now)
+            reactive.set_flag(REJOIN_PENDING_FLAG)
+        return True
+
+    def release_restart_token(self):
+        """Release the restart token once the conductor rejoined the ring.
+
+        The hook does not wait for the conductor, this is checked once on
+        every hook, including update-status, while REJOIN_PENDING_FLAG is
+        set. The token is released anyway once the conductor was restarted
+        more than CONDUCTOR_REJOIN_TIMEOUT seconds ago.
+
+        :returns: True if the token was released, False if it is kept.
+        """
+        restarted = unitdata.kv().get(REJOIN_PENDING_KEY) or 0
+        if time.time() - restarted >= CONDUCTOR_REJOIN_TIMEOUT:
+            hookenv.log("conductor has not rejoined the hash ring %d seconds "
+                        "after its restart, releasing the restart token "
+                        "anyway" % CONDUCTOR_REJOIN_TIMEOUT,
+                        level=hookenv.WARNING)
+        elif not self._conductor_rejoined():
+            hookenv.log("conductor has not rejoined the hash ring yet, "
+                        "keeping the restart token", level=hookenv.INFO)
+            return False
+        rolling_restart.release_token()
+        unitdata.kv().unset(REJOIN_PENDING_KEY)
+        reactive.clear_flag(REJOIN_PENDING_FLAG)
+        return True
+
+    def grant_restart_tokens(self):
+        """Hand out the restart tokens to the units. Run on the leader."""
+        batch_size = self.config.get('restart-batch-size') or 0
+        if batch_size > 0:
+            rolling_restart.grant_tokens(batch_size)
+
+    @profiling.timed('assess_status')
+    def _assess_status(self):
+        super()._assess_status()
+
     def get_amqp_credentials(self):
         """Provide the default amqp username and vhost as a tuple.
 
@@ -401,6 +1668,209 @@ class IronicConductorCharm(charms_openstack.charm.OpenStackCharm):
                 'hardware type(s) %s not supported at '
                 'this time' % ", ".join(unsupported))
 
+    def _validate_non_negative_ints(self, options):
+        """Check that integer options are not negative.
+
+        Unset options, and boolean options sharing an option table with
+        integer ones, are not checked.
+
+        :param options: the names of the charm options to check.
+        :raises: ValueError for the first negative option.
+        """
+        for charm_opt in options:
+            value = self.config.get(charm_opt, None) or 0
+            if not isinstance(value, bool) and value < 0:
+                raise ValueError(
+                    '%s must be a positive integer or 0, got %s' % (
+                        charm_opt, value))
+
+    def _validate_conductor_tuning(self):
+        mode = self.config.get('conductor-tuning-mode', None) or 'manual'
+        if mode not in VALID_CONDUCTOR_TUNING_MODES:
+            raise ValueError(
+                'conductor-tuning-mode %s is not valid. Valid '
+                'modes are: %s' % (
+                    mode, ", ".join(VALID_CONDUCTOR_TUNING_MODES)))
+
+        self._validate_non_negative_ints(_CONDUCTOR_TUNING_OPTIONS)
+
+        tuning = deepcopy(_CONDUCTOR_TUNING_DEFAULTS)
+        tuning.update(self._get_conductor_tuning_config())
+        workers = (tuning['periodic_max_workers'] +
+                   tuning['sync_power_state_workers'])
+        if tuning['workers_pool_size'] <= workers:
+            raise ValueError(
+                'workers pool size (%s) must be larger than the sum of '
+                'periodic max workers and sync power state workers '
+                '(%s)' % (tuning['workers_pool_size'], workers))
+
+    def _validate_ipmi_tuning(self):
+        self._validate_non_negative_ints(_IPMI_TUNING_OPTIONS)
+
+    def _validate_redfish_tuning(self):
+        self._validate_non_negative_ints(
+            [charm_opt for charm_opt in _REDFISH_TUNING_OPTIONS
+             if charm_opt != 'redfish-auth-type'])
+        auth_type = self.config.get('redfish-auth-type', None)
+        if auth_type and auth_type not in VALID_REDFISH_AUTH_TYPES:
+            raise ValueError(
+                'redfish-auth-type %s is not valid. Valid '
+                'types are: %s' % (
+                    auth_type, ", ".join(VALID_REDFISH_AUTH_TYPES)))
+
+    def _validate_database_tuning(self):
+        self._validate_non_negative_ints(_DATABASE_TUNING_OPTIONS)
+
+    def _validate_database_read_only_port(self):
+        port = self.config.get('database-read-only-port', None) or 0
+        if port < 0 or port > MAX_PORT:
+            raise ValueError(
+                'database-read-only-port must be a port number or 0, '
+                'got %s' % port)
+
+    def _validate_messaging(self):
+        profile = self.config.get('messaging-profile', None) or 'default'
+        if profile not in _MESSAGING_PROFILES:
+            raise ValueError(
+                'messaging-profile %s is not valid. Valid '
+                'profiles are: %s' % (
+                    profile, ", ".join(sorted(_MESSAGING_PROFILES))))
+        self._validate_non_negative_ints(_MESSAGING_OPTIONS)
+        messaging = self._get_messaging_config()['oslo_messaging_rabbit']
+        threshold = messaging.get('heartbeat_timeout_threshold', None)
+        rate = messaging.get('heartbeat_rate', None)
+        if threshold and rate and rate > threshold:
+            raise ValueError(
+                'rabbit-heartbeat-rate (%s) must not be larger than '
+                'rabbit-heartbeat-timeout-threshold (%s)' % (
+                    rate, threshold))
+
+    def _validate_rpc_transport(self):
+        transport = self.config.get('rpc-transport', None) or 'oslo'
+        if transport not in VALID_RPC_TRANSPORTS:
+            raise ValueError(
+                'rpc-transport %s is not valid. Valid '
+                'transports are: %s' % (
+                    transport, ", ".join(VALID_RPC_TRANSPORTS)))
+        port = self.config.get('json-rpc-port', None) or 0
+        if port < 0 or port > MAX_PORT:
+            raise ValueError(
+                'json-rpc-port must be a port number or 0, got %s' % port)
+
+    def _validate_token_cache(self):
+        token_cache = self.config.get('token-cache', None) or 'none'
+        if token_cache not in VALID_TOKEN_CACHES:
+            raise ValueError(
+                'token-cache %s is not valid. Valid '
+                'options are: %s' % (
+                    token_cache, ", ".join(VALID_TOKEN_CACHES)))
+        if token_cache == 'relation' and not self.config["use_memcache"]:
+            raise ValueError(
+                'token-cache is "relation", but no memcached server is '
+                'available on the %s relation' % MEMCACHE_RELATION)
+
+    def _validate_hash_ring(self):
+        group = self._get_conductor_group()
+        if not VALID_CONDUCTOR_GROUP.match(group):
+            raise ValueError(
+                'conductor group %s is not valid, only letters, digits, '
+                '"_", "-" and "." are allowed' % group)
+        if len(group) > MAX_CONDUCTOR_GROUP_LENGTH:
+            raise ValueError(
+                'conductor group must be at most %d characters long' % (
+                    MAX_CONDUCTOR_GROUP_LENGTH))
+
+        self._validate_non_negative_ints(_HASH_RING_OPTIONS)
+
+    def _validate_image_cache(self):
+        self._validate_non_negative_ints(
+            ('image-cache-size', 'image-cache-ttl'))
+        percent = self.config.get('image-cache-free-space-percent', None)
+        if percent is not None and not 0 < percent <= 100:
+            raise ValueError(
+                'image-cache-free-space-percent must be between 1 and '
+                '100, got %s' % percent)
+
+    def _validate_image_conversion(self):
+        self._validate_non_negative_ints(
+            ('image-download-concurrency', 'image-convert-memory-limit'))
+        configs = self._get_image_conversion_config()
+        concurrency = configs.get('image_download_concurrency', None)
+        if not configs.get('force_raw_images') or not concurrency:
+            return
+        memory_limit = configs.get(
+            'image_convert_memory_limit', DEFAULT_IMAGE_CONVERT_MEMORY_LIMIT)
+        budget = self._get_image_conversion_memory_budget()
+        if concurrency * memory_limit > budget:
+            raise ValueError(
+                '%s concurrent image conversions of up to %s MiB each need '
+                'more than %s%% of the RAM of the unit (%s MiB)' % (
+                    concurrency, memory_limit,
+                    IMAGE_CONVERSION_RAM_PERCENT, budget))
+
+    def _validate_cleaning(self):
+        profile = self.config.get('cleaning-profile', None) or 'default'
+        if profile not in _CLEANING_PROFILES:
+            raise ValueError(
+                'cleaning-profile %s is not valid. Valid '
+                'profiles are: %s' % (
+                    profile, ", ".join(sorted(_CLEANING_PROFILES))))
+        for charm_opt in _CLEANING_OPTIONS:
+            value = self.config.get(charm_opt, None)
+            if value is not None and value < -1:
+                raise ValueError(
+                    '%s must be a positive integer, 0 or -1, got %s' % (
+                        charm_opt, value))
+
+    def _validate_deploy_logs_retention(self):
+        self._validate_non_negative_ints(
+            ('deploy-logs-max-age', 'deploy-logs-max-size',
+             'deploy-logs-compress-after'))
+        if self.deploy_logs_local:
+            path = self.config.get('deploy-logs-local-path', None) or ""
+            if not os.path.isabs(path):
+                raise ValueError(
+                    'deploy-logs-local-path must be an absolute path, '
+                    'got "%s"' % path)
+
+    def _validate_http_boot_profile(self):
+        profile = self.config.get('http-boot-profile', None) or 'default'
+        if profile not in VALID_HTTP_BOOT_PROFILES:
+            raise ValueError(
+                'http-boot-profile %s is not valid. Valid '
+                'profiles are: %s' % (
+                    profile, ", ".join(VALID_HTTP_BOOT_PROFILES)))
+
+    def _validate_tftp_config(self):
+        profile = self.config.get('tftp-boot-profile', None) or 'default'
+        if profile not in _TFTP_PROFILES:
+            raise ValueError(
+                'tftp-boot-profile %s is not valid. Valid '
+                'profiles are: %s' % (
+                    profile, ", ".join(sorted(_TFTP_PROFILES))))
+
+        verbosity = self.config.get('tftp-verbosity', None)
+        if verbosity is not None and not (
+                -1 <= verbosity <= MAX_TFTP_VERBOSITY):
+            raise ValueError(
+                'tftp-verbosity must be between 0 and %d, or -1, got %s' % (
+                    MAX_TFTP_VERBOSITY, verbosity))
+
+        self._validate_non_negative_ints(('tftp-retransmit-timeout',))
+
+        ip_version = self.config.get('tftp-ip-version', None) or "4"
+        if ip_version not in VALID_TFTP_IP_VERSIONS:
+            raise ValueError(
+                'tftp-ip-version %s is not valid. Valid options are: %s' % (
+                    ip_version, ", ".join(VALID_TFTP_IP_VERSIONS)))
+
+        for option in self.tftp_refuse_options:
+            if option not in VALID_TFTP_REFUSE_OPTIONS:
+                raise ValueError(
+                    'TFTP option %s can not be refused. Valid options '
+                    'are: %s' % (
+                        option, ", ".join(VALID_TFTP_REFUSE_OPTIONS)))
+
     @property
     def enabled_network_interfaces(self):
         network_interfaces = self.config.get(
@@ -420,39 +1890,82 @@ class IronicConductorCharm(charms_openstack.charm.OpenStackCharm):
         return network_interfaces.split(",")
 
     def custom_assess_status_check(self):
-        try:
-            self._validate_network_interfaces(self.enabled_network_interfaces)
-        except Exception as err:
-            msg = ("invalid enabled-network-interfaces config, %s" % err)
-            return ('blocked', msg)
-
-        try:
-            self._validate_default_net_interface()
-        except Exception as err:
-            msg = ("invalid default-network-interface config, %s" % err)
-            return ('blocked', msg)
-
-        try:
-            self._validate_deploy_interfaces(
-                self.enabled_deploy_interfaces)
-        except Exception as err:
-            msg = ("invalid enabled-deploy-interfaces config, %s" % err)
-            return ('blocked', msg)
-
-        try:
-            self._validate_default_deploy_interface()
-        except Exception as err:
-            msg = ("invalid default-deploy-interface config, %s" % err)
-            return ('blocked', msg)
-
-        try:
-            self._validate_enabled_hw_type()
-        except Exception as err:
-            msg = ("invalid enabled-hw-types config, %s" % err)
-            return ('blocked', msg)
-
+        checks = (
+            ("enabled-network-interfaces config",
+             lambda: self._validate_network_interfaces(
+                 self.enabled_network_interfaces)),
+            ("default-network-interface config",
+             self._validate_default_net_interface),
+            ("enabled-deploy-interfaces config",
+             lambda: self._validate_deploy_interfaces(
+                 self.enabled_deploy_interfaces)),
+            ("default-deploy-interface config",
+             self._validate_default_deploy_interface),
+            ("enabled-hw-types config", self._validate_enabled_hw_type),
+            ("conductor tuning config", self._validate_conductor_tuning),
+            ("IPMI tuning config", self._validate_ipmi_tuning),
+            ("Redfish tuning config", self._validate_redfish_tuning),
+            ("database tuning config", self._validate_database_tuning),
+            ("database config", self._validate_database_read_only_port),
+            ("messaging config", self._validate_messaging),
+            ("RPC transport config", self._validate_rpc_transport),
+            ("token cache config", self._validate_token_cache),
+            ("hash ring config", self._validate_hash_ring),
+            ("image cache config", self._validate_image_cache),
+            ("image conversion config", self._validate_image_conversion),
+            ("cleaning config", self._validate_cleaning),
+            ("deploy logs config", self._validate_deploy_logs_retention),
+            ("http-boot-profile config", self._validate_http_boot_profile),
+            ("TFTP config", self._validate_tftp_config),
+        )
+        for name, check in checks:
+            try:
+                check()
+            except Exception as err:
+                return ('blocked', "invalid %s, %s" % (name, err))
+
+        for warning in self._get_ipmi_tuning_warnings():
+            hookenv.log("inconsistent IPMI tuning config, %s" % warning,
+                        level=hookenv.WARNING)
+        for warning in self._get_database_tuning_warnings():
+            hookenv.log("database connection pools too large, %s" % warning,
+                        level=hookenv.WARNING)
         return (None, None)
 
+    def custom_assess_status_last_check(self):
+        usage = self._get_image_cache_usage()
+        if self.config["image_cache"]["size"]:
+            capacity = self.config["image_cache"]["size"] * len(
+                self.image_cache_dirs)
+            msg = "Unit is ready, image cache %d/%d MiB used" % (
+                usage / MIB, capacity)
+        else:
+            # not sized yet
+            msg = "Unit is ready, image cache %d MiB used" % (usage / MIB)
+        deferred = unitdata.kv().get(RESTART_DEFERRED_KEY)
+        if deferred and deferred["reservations"]:
+            msg += (", conductor restart deferred, %d nodes locked" %
+                    deferred["reservations"])
+        elif deferred:
+            msg += ", conductor restart waiting for a restart token"
+        elif reactive.is_flag_set(REJOIN_PENDING_FLAG):
+            msg += ", waiting for the conductor to rejoin the hash ring"
+        retention = self.config["deploy_logs_retention"]
+        if retention:
+            logs_usage = self._get_dirs_usage(
+                [retention["path"]])[retention["path"]]
+            if retention["max_size_bytes"]:
+                msg += ", deploy logs %d/%d MiB used" % (
+                    logs_usage / MIB, retention["max_size_bytes"] / MIB)
+            else:
+                msg += ", deploy logs %d MiB used" % (logs_usage / MIB)
+        if self._get_ipmi_tuning_warnings():
+            msg += ", inconsistent IPMI tuning (see juju debug-log)"
+        if self._get_database_tuning_warnings():
+            msg += ", database connections may run out (see juju debug-log)"
+        return ('active', msg)
+
+    @profiling.timed('upgrade_charm')
     def upgrade_charm(self):
         """Custom upgrade charm.
 
@@ -473,11 +1986,14 @@ class IronicConductorCharm(charms_openstack.charm.OpenStackCharm):
             host.mkdir(IRONIC_CONF_D)
 
         # reconfigure ironic-conductor to run it with --conf-dir
-        release = ch_utils.os_release('ironic-common')
+        release = cached_os_release('ironic-common')
         configs = templating.OSConfigRenderer(templates_dir='templates/',
                                               openstack_release=release)
         configs.register(config_file=IRONIC_DEFAULT, contexts=[])
-        configs.write_all()
+        # write_file() leaves the file untouched if the content is the same
+        host.write_file(
+            IRONIC_DEFAULT, configs.render(IRONIC_DEFAULT).encode('UTF-8'),
+            perms=0o644)
 
 
 class IronicConductorXenaCharm(IronicConductorCharm):
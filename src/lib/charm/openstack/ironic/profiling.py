@@ -0,0 +1,176 @@
+"""Opt-in timing and profiling of the charm hooks.
+
+When the hook-profiling config option is enabled, every phase wrapped with
+phase() or timed() records its wall-clock duration, and the hook runs under
+cProfile from the moment the reactive handlers are loaded, see start(). At
+the end of the hook, a cProfile dump and a JSON summary of the phase timings
+are written to PROFILES_DIR_NAME in the charm dir.
+"""
+
+import contextlib
+import cProfile
+import functools
+import glob
+import json
+import os
+import time
+
+import charmhelpers.core.hookenv as hookenv
+
+PROFILES_DIR_NAME = "hook-profiles"
+# Number of hooks for which profiles are kept on disk.
+MAX_PROFILES = 50
+
+_state = {
+    "profiler": None,
+    "started": None,
+    "depth": 0,
+    "phases": [],
+}
+
+
+def enabled():
+    return bool(hookenv.config().get("hook-profiling", False))
+
+
+def get_profiles_dir():
+    return os.path.join(hookenv.charm_dir(), PROFILES_DIR_NAME)
+
+
+def _start():
+    if _state["profiler"] is not None:
+        return
+    _state["started"] = time.time()
+    _state["profiler"] = cProfile.Profile()
+    _state["profiler"].enable()
+    hookenv.atexit(_finish)
+
+
+def start():
+    """Start profiling the hook, if hook-profiling is enabled.
+
+    This is called when the reactive handlers are loaded, so the profile
+    also covers the charm code run outside of the phases, such as loading
+    and instantiating the charm class. Nothing is done outside of a hook.
+    """
+    if "JUJU_UNIT_NAME" not in os.environ or not enabled():
+        return
+    _start()
+
+
+def _prune(profiles_dir):
+    summaries = sorted(glob.glob(os.path.join(profiles_dir, "*.json")))
+    for summary in summaries[:-MAX_PROFILES]:
+        base = os.path.splitext(summary)[0]
+        for path in (summary, base + ".prof"):
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def _finish():
+    profiler = _state["profiler"]
+    if profiler is None:
+        return
+    profiler.disable()
+    profiles_dir = get_profiles_dir()
+    if not os.path.isdir(profiles_dir):
+        os.makedirs(profiles_dir)
+    hook = hookenv.hook_name()
+    base = os.path.join(
+        profiles_dir, "%s-%s" % (
+            time.strftime("%Y%m%d%H%M%S", time.gmtime(_state["started"])),
+            hook))
+    profiler.dump_stats(base + ".prof")
+    summary = {
+        "hook": hook,
+        "started": _state["started"],
+        "duration": time.time() - _state["started"],
+        "phases": _state["phases"],
+    }
+    with open(base + ".json", "w") as fd:
+        json.dump(summary, fd, indent=2)
+    _prune(profiles_dir)
+    _state["profiler"] = None
+    _state["phases"] = []
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Record the wall-clock duration of the wrapped block.
+
+    :param name: the name of the phase, as reported by show-hook-timings.
+    """
+    if not enabled():
+        yield
+        return
+    _start()
+    start = time.time()
+    _state["depth"] += 1
+    try:
+        yield
+    finally:
+        _state["depth"] -= 1
+        _state["phases"].append({
+            "phase": name,
+            "depth": _state["depth"],
+            "duration": time.time() - start,
+        })
+
+
+def timed(name):
+    """Decorator recording the duration of a function as a phase.
+
+    Do not use this on reactive handlers, as charms.reactive identifies
+    handlers by their code object. Use phase() in the handler body instead.
+    """
+    def wrapper(f):
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            with phase(name):
+                return f(*args, **kwargs)
+        return wrapped
+    return wrapper
+
+
+def load_summaries(hook=None):
+    """Load the JSON timing summaries written by previous hooks.
+
+    :param hook: only load the summaries of this hook.
+    :returns: list of summaries, oldest first.
+    """
+    summaries = []
+    pattern = os.path.join(get_profiles_dir(), "*.json")
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as fd:
+            summary = json.load(fd)
+        if hook and summary.get("hook") != hook:
+            continue
+        summaries.append(summary)
+    return summaries
+
+
+def get_slowest_phases(summaries, count=10):
+    """Aggregate phase timings and return the slowest ones.
+
+    :param summaries: list of summaries, as returned by load_summaries().
+    :param count: maximum number of phases to return.
+    :returns: list of dicts with the hook, phase, number of calls, mean and
+        max duration, sorted by max duration.
+    """
+    stats = {}
+    for summary in summaries:
+        for item in summary.get("phases", []):
+            key = (summary.get("hook"), item["phase"])
+            stat = stats.setdefault(key, [])
+            stat.append(item["duration"])
+    result = []
+    for (hook, name), durations in stats.items():
+        result.append({
+            "hook": hook,
+            "phase": name,
+            "calls": len(durations),
+            "mean": sum(durations) / len(durations),
+            "max": max(durations),
+        })
+    result.sort(key=lambda x: x["max"], reverse=True)
+    return result[:count]
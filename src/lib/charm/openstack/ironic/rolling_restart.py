@@ -0,0 +1,104 @@
+"""Rolling restarts of the conductors of the application.
+
+A unit that needs to restart its conductor requests a restart token by
+setting RESTART_REQUEST_KEY in its data on the peer relation. The leader
+hands out the tokens, in the order they were requested, through the
+RESTART_TOKENS_KEY leader setting, so at most restart-batch-size units
+restart at the same time. A unit releases its token, by clearing its
+request, once its conductor has rejoined the hash ring.
+"""
+
+import json
+import time
+
+import charmhelpers.core.hookenv as hookenv
+import charms.leadership as leadership
+
+PEER_RELATION = "cluster"
+RESTART_REQUEST_KEY = "restart-requested"
+RESTART_TOKENS_KEY = "restart-tokens"
+
+
+def _peer_relation_id():
+    rids = hookenv.relation_ids(PEER_RELATION)
+    return rids[0] if rids else None
+
+
+def get_tokens():
+    """Get the units currently holding a restart token.
+
+    :returns: list of unit names.
+    """
+    tokens = leadership.leader_get(RESTART_TOKENS_KEY)
+    return json.loads(tokens) if tokens else []
+
+
+def get_requests():
+    """Get the pending restart token requests of the application.
+
+    :returns: dict mapping the unit names to the time of their request.
+    """
+    rid = _peer_relation_id()
+    if rid is None:
+        return {}
+    requests = {}
+    units = [hookenv.local_unit()] + hookenv.related_units(rid)
+    for unit in units:
+        requested = hookenv.relation_get(
+            RESTART_REQUEST_KEY, rid=rid, unit=unit)
+        if requested:
+            requests[unit] = float(requested)
+    return requests
+
+
+def grant_tokens(batch_size):
+    """Hand out the restart tokens. Must be run on the leader.
+
+    Tokens of the units that no longer request one are taken back, and the
+    free tokens are granted to the oldest requests.
+
+    :param batch_size: maximum number of units restarting at the same time.
+    :returns: list of the units holding a token.
+    """
+    requests = get_requests()
+    current = get_tokens()
+    tokens = [unit for unit in current if unit in requests]
+    pending = sorted(
+        (unit for unit in requests if unit not in tokens),
+        key=lambda unit: (requests[unit], unit))
+    tokens += pending[:max(batch_size - len(tokens), 0)]
+    if tokens != current:
+        hookenv.log("restart tokens held by: %s" % ", ".join(tokens),
+                    level=hookenv.DEBUG)
+        leadership.leader_set({RESTART_TOKENS_KEY: json.dumps(tokens)})
+    return tokens
+
+
+def acquire_token(batch_size):
+    """Request a restart token for the local unit.
+
+    :param batch_size: maximum number of units restarting at the same time.
+    :returns: True if the local unit holds a token, False if it must wait
+              for the leader to grant one.
+    """
+    rid = _peer_relation_id()
+    if rid is None:
+        # no peers to coordinate with
+        return True
+    unit = hookenv.local_unit()
+    if not hookenv.relation_get(RESTART_REQUEST_KEY, rid=rid, unit=unit):
+        hookenv.relation_set(
+            relation_id=rid,
+            relation_settings={RESTART_REQUEST_KEY: repr(time.time())})
+    if hookenv.is_leader():
+        return unit in grant_tokens(batch_size)
+    return unit in get_tokens()
+
+
+def release_token():
+    """Release the restart token of the local unit, if it holds one."""
+    rid = _peer_relation_id()
+    if rid is None:
+        return
+    hookenv.relation_set(
+        relation_id=rid, relation_settings={RESTART_REQUEST_KEY: None})
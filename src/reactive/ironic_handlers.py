@@ -5,6 +5,11 @@ import charmhelpers.core.hookenv as hookenv
 
 import charms_openstack.charm as charm
 
+import charm.openstack.ironic.profiling as profiling
+
+# Profile the whole hook, not only the handlers, when hook-profiling is set.
+profiling.start()
+
 # Use the charms.openstack defaults for common states and hooks
 charm.use_defaults(
     'charm.installed',
@@ -20,34 +25,86 @@ charm.use_defaults(
 @reactive.when('amqp.available')
 def render(*args):
     hookenv.log("about to call the render_configs with {}".format(args))
-    with charm.provide_charm_instance() as ironic_charm:
-        ironic_charm.upgrade_if_available(args)
-        ironic_charm.render_with_interfaces(
-            charm.optional_interfaces(args))
-        ironic_charm.configure_tls()
-        ironic_charm.assess_status()
+    with profiling.phase('render'):
+        with charm.provide_charm_instance() as ironic_charm:
+            ironic_charm.upgrade_if_available(args)
+            ironic_charm.render_with_interfaces(
+                charm.optional_interfaces(args))
+            ironic_charm.configure_deploy_logs_retention()
+            ironic_charm.configure_tls()
+            ironic_charm.assess_status()
     reactive.set_state('config.complete')
 
 
 @reactive.when('identity-credentials.connected')
 def request_keystone_credentials(keystone):
-    with charm.provide_charm_instance() as ironic_charm:
-        keystone.request_credentials(
-            ironic_charm.name, region=ironic_charm.region)
-        ironic_charm.assess_status()
+    with profiling.phase('request_keystone_credentials'):
+        with charm.provide_charm_instance() as ironic_charm:
+            keystone.request_credentials(
+                ironic_charm.name, region=ironic_charm.region)
+            ironic_charm.assess_status()
 
 
 @reactive.when('amqp.connected')
 def request_amqp_access(amqp):
-    with charm.provide_charm_instance() as ironic_charm:
-        user, vhost = ironic_charm.get_amqp_credentials()
-        amqp.request_access(username=user, vhost=vhost)
-        ironic_charm.assess_status()
+    with profiling.phase('request_amqp_access'):
+        with charm.provide_charm_instance() as ironic_charm:
+            user, vhost = ironic_charm.get_amqp_credentials()
+            amqp.request_access(username=user, vhost=vhost)
+            ironic_charm.assess_status()
 
 
 @reactive.when('shared-db.connected')
 def request_database_access(database):
-    with charm.provide_charm_instance() as ironic_charm:
-        for db in ironic_charm.get_database_setup():
-            database.configure(**db)
-        ironic_charm.assess_status()
+    with profiling.phase('request_database_access'):
+        with charm.provide_charm_instance() as ironic_charm:
+            for db in ironic_charm.get_database_setup():
+                database.configure(**db)
+            ironic_charm.assess_status()
+
+
+@reactive.when('ironic-conductor.restart-deferred')
+def restart_deferred_conductor():
+    with profiling.phase('restart_deferred_conductor'):
+        with charm.provide_charm_instance() as ironic_charm:
+            ironic_charm.restart_conductor()
+            ironic_charm.assess_status()
+
+
+@reactive.when('ironic-conductor.rejoin-pending')
+def release_restart_token():
+    with profiling.phase('release_restart_token'):
+        with charm.provide_charm_instance() as ironic_charm:
+            ironic_charm.release_restart_token()
+            ironic_charm.assess_status()
+
+
+@reactive.when('leadership.is_leader')
+def grant_restart_tokens():
+    with profiling.phase('grant_restart_tokens'):
+        with charm.provide_charm_instance() as ironic_charm:
+            ironic_charm.grant_restart_tokens()
+
+
+# Package upgrades, including the ones done outside of the charm, may
+# replace the boot loaders. They are only copied again when they changed,
+# which takes a few stat() calls per boot loader.
+@reactive.when('charm.installed')
+def copy_boot_loaders():
+    with profiling.phase('copy_boot_loaders'):
+        with charm.provide_charm_instance() as ironic_charm:
+            ironic_charm.pxe_config._copy_resources()
+
+
+@reactive.when('ironic-api.available')
+def publish_rpc_transport(*args):
+    with profiling.phase('publish_rpc_transport'):
+        with charm.provide_charm_instance() as ironic_charm:
+            ironic_charm.publish_rpc_transport()
+
+
+@reactive.when('config.changed.token-cache')
+def configure_token_cache():
+    with profiling.phase('configure_token_cache'):
+        with charm.provide_charm_instance() as ironic_charm:
+            ironic_charm.configure_token_cache()
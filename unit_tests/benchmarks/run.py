@@ -0,0 +1,371 @@
+# Copyright 2026 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hook latency benchmarks of the ironic-conductor charm.
+
+The charm code runs with charmhelpers, charms.reactive and the OpenStack
+clients stubbed the same way as in the unit tests, so the timings measure
+the charm itself, not the hook tools, apt or the API calls. Boot loaders are
+copied between temporary directories, and unitdata is kept in memory. As
+charmhelpers writes the configuration files, the render phase measures
+building the template contexts, not rendering the templates.
+
+Every phase is run a number of times, with the per hook caches cleared
+before each run, as every hook runs in a new process. Run it from the root
+of the repository, with the test requirements installed:
+
+    tox -e py3 --notest
+    .tox/py3/bin/python3 -m unit_tests.benchmarks.run --output before.json
+    git checkout <other commit>
+    .tox/py3/bin/python3 -m unit_tests.benchmarks.run --compare before.json
+
+Comparing exits with a non-zero status if the median time of a phase grew
+by more than --threshold percent.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+import yaml
+
+# Stubs charmhelpers, charms.reactive and the OpenStack clients, and puts
+# the charm code on the path.
+import unit_tests  # noqa
+
+import charmhelpers.core.hookenv as hookenv
+
+from charm.openstack.ironic import controller_utils
+from charm.openstack.ironic import ironic
+
+SRC_DIR = os.path.abspath("src")
+CONFIG_YAML = os.path.join(SRC_DIR, "config.yaml")
+
+DEFAULT_ITERATIONS = 50
+DEFAULT_WARMUP = 3
+DEFAULT_THRESHOLD = 20
+# Median times below this many milliseconds apart are considered noise.
+MIN_REGRESSION_MS = 0.05
+
+RELEASES = [
+    "train", "ussuri", "victoria", "wallaby", "xena", "yoga", "zed",
+    "antelope", "bobcat", "caracal", "dalmatian", "epoxy",
+]
+
+
+class _CompareOpenStackReleases(str):
+    """Minimal stand in for the charmhelpers release comparator."""
+
+    def _index(self, other):
+        return RELEASES.index(other)
+
+    def __lt__(self, other):
+        return self._index(self) < self._index(other)
+
+    def __le__(self, other):
+        return self._index(self) <= self._index(other)
+
+    def __gt__(self, other):
+        return self._index(self) > self._index(other)
+
+    def __ge__(self, other):
+        return self._index(self) >= self._index(other)
+
+
+class _MemoryKV(object):
+    """In memory replacement for unitdata.kv()."""
+
+    def __init__(self):
+        self._data = {}
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def set(self, key, value):
+        self._data[key] = value
+
+    def unset(self, key):
+        self._data.pop(key, None)
+
+    def flush(self):
+        pass
+
+
+def load_config_defaults(path=CONFIG_YAML):
+    """Return the charm config, with every option set to its default."""
+    with open(path) as fd:
+        options = yaml.safe_load(fd)["options"]
+    return dict(
+        (name, opt.get("default")) for name, opt in options.items())
+
+
+def _setup_stubs(workdir, release):
+    """Point the stubbed charmhelpers at the benchmark environment.
+
+    :param workdir: temporary directory used as the filesystem of the unit.
+    :param release: the OpenStack release the charm runs.
+    :returns: list of the started patches.
+    """
+    config = load_config_defaults()
+    config["enabled-hw-types"] = "ipmi, redfish, idrac"
+    hookenv.config.return_value = config
+    hookenv.charm_dir.return_value = SRC_DIR
+    ironic.os_release.return_value = release
+    ironic.unitdata.kv.return_value = _MemoryKV()
+
+    # Boot loaders shipped by the packages, and the TFTP and HTTP roots.
+    loaders_dir = os.path.join(workdir, "loaders")
+    os.makedirs(loaders_dir)
+    file_map = {}
+    for name in controller_utils.PXEBootBase.FILE_MAP.values():
+        src = os.path.join(loaders_dir, name)
+        with open(src, "wb") as fd:
+            fd.write(os.urandom(256 * 1024))
+        file_map[src] = name
+    tftp_root = os.path.join(workdir, "tftpboot")
+    pxe_attrs = {
+        "FILE_MAP": file_map,
+        "HTTP_FILE_MAP": {},
+        "TFTP_ROOT": tftp_root,
+        "HTTP_ROOT": os.path.join(workdir, "httpboot"),
+        "GRUB_DIR": os.path.join(tftp_root, "grub"),
+    }
+    patches = [
+        mock.patch.object(controller_utils.PXEBootBase, attr, value)
+        for attr, value in pxe_attrs.items()]
+    patches.extend([
+        mock.patch.object(
+            ironic, "CompareOpenStackReleases",
+            new=_CompareOpenStackReleases),
+        mock.patch.object(controller_utils.shutil, "chown"),
+        mock.patch.object(
+            controller_utils, "get_free_space",
+            return_value=100 * 1024 * ironic.MIB),
+    ])
+    for patch in patches:
+        patch.start()
+    return patches
+
+
+def _new_hook():
+    """Reset the state a hook starts with, as it runs in a new process."""
+    ironic._HOOK_CACHE.clear()
+
+
+def _fake_interfaces():
+    interfaces = []
+    for name in ("shared-db", "ironic-api", "identity-credentials", "amqp"):
+        interface = mock.MagicMock()
+        interface.endpoint_name = name
+        interfaces.append(interface)
+    return interfaces
+
+
+def get_phases():
+    """Return the benchmarked phases, as (name, setup) tuples.
+
+    setup() is called before every run of the phase, and returns the
+    callable that is timed.
+    """
+    def init():
+        return ironic.IronicConductorCharm
+
+    def render():
+        charm = ironic.IronicConductorCharm()
+        interfaces = _fake_interfaces()
+        return lambda: charm.render_with_interfaces(interfaces)
+
+    def install():
+        charm = ironic.IronicConductorCharm()
+        return charm.install
+
+    def custom_assess_status_check():
+        charm = ironic.IronicConductorCharm()
+        return charm.custom_assess_status_check
+
+    def get_hardware_types_config():
+        charm = ironic.IronicConductorCharm()
+        # measure the computation, not the per hook cache
+        ironic._HOOK_CACHE.clear()
+        return charm._get_hardware_types_config
+
+    return [
+        ("init", init),
+        ("render", render),
+        ("install", install),
+        ("custom_assess_status_check", custom_assess_status_check),
+        ("_get_hardware_types_config", get_hardware_types_config),
+    ]
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = int(round((len(values) - 1) * percent / 100.0))
+    return values[index]
+
+
+def summarize(durations, peaks):
+    """Summarize the runs of a phase.
+
+    :param durations: list of the durations of the runs, in seconds.
+    :param peaks: list of the peak memory allocated by the runs, in bytes.
+    :returns: dict of statistics, times in milliseconds and sizes in KiB.
+    """
+    durations_ms = [i * 1000 for i in durations]
+    return {
+        "runs": len(durations_ms),
+        "median_ms": statistics.median(durations_ms),
+        "p90_ms": _percentile(durations_ms, 90),
+        "mean_ms": statistics.mean(durations_ms),
+        "peak_kib": max(peaks) / 1024.0 if peaks else 0.0,
+    }
+
+
+def run_phase(setup, iterations, warmup):
+    """Time a phase, then measure its memory allocations.
+
+    Allocations are measured in separate runs, as tracing them slows the
+    code down.
+    """
+    for _ in range(warmup):
+        _new_hook()
+        setup()()
+    durations = []
+    for _ in range(iterations):
+        _new_hook()
+        call = setup()
+        start = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - start)
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(min(iterations, 5)):
+            _new_hook()
+            call = setup()
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            call()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+    return summarize(durations, peaks)
+
+
+def run(iterations=DEFAULT_ITERATIONS, warmup=DEFAULT_WARMUP,
+        release="yoga", only=None):
+    """Run the benchmarks.
+
+    :param only: list of the names of the phases to run, or None for all.
+    :returns: dict with the environment and the results of every phase.
+    """
+    workdir = tempfile.mkdtemp()
+    patches = _setup_stubs(workdir, release)
+    try:
+        results = {}
+        for name, setup in get_phases():
+            if only and name not in only:
+                continue
+            results[name] = run_phase(setup, iterations, warmup)
+    finally:
+        for patch in patches:
+            patch.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "python": platform.python_version(),
+        "release": release,
+        "iterations": iterations,
+        "results": results,
+    }
+
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Compare the results of two benchmark runs.
+
+    :param baseline: results of the reference run, as returned by run().
+    :param current: results of the run to check.
+    :param threshold: growth of the median time, in percent, over which a
+                      phase is reported as a regression.
+    :returns: tuple of (lines describing every phase, names of the phases
+              that regressed).
+    """
+    lines = []
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            lines.append("%-28s %9.3f ms (new)" % (name, result["median_ms"]))
+            continue
+        delta = result["median_ms"] - base["median_ms"]
+        percent = delta * 100.0 / base["median_ms"] if base["median_ms"] else 0
+        status = ""
+        if percent > threshold and delta > MIN_REGRESSION_MS:
+            status = " REGRESSION"
+            regressions.append(name)
+        lines.append("%-28s %9.3f ms -> %9.3f ms (%+.1f%%)%s" % (
+            name, base["median_ms"], result["median_ms"], percent, status))
+    return lines, regressions
+
+
+def format_results(results):
+    lines = ["%-28s %10s %10s %10s %10s" % (
+        "phase", "median ms", "p90 ms", "mean ms", "peak KiB")]
+    for name, result in results["results"].items():
+        lines.append("%-28s %10.3f %10.3f %10.3f %10.1f" % (
+            name, result["median_ms"], result["p90_ms"], result["mean_ms"],
+            result["peak_kib"]))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP)
+    parser.add_argument("--release", default="yoga")
+    parser.add_argument("--phase", action="append", dest="phases",
+                        help="only run this phase, may be repeated")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare",
+                        help="compare with the results in this file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="regression threshold, in percent")
+    args = parser.parse_args(argv)
+
+    results = run(iterations=args.iterations, warmup=args.warmup,
+                  release=args.release, only=args.phases)
+    print("\n".join(format_results(results)))
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(results, fd, indent=2)
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)
+        lines, regressions = compare_results(
+            baseline, results, threshold=args.threshold)
+        print("\n".join(["", "compared with %s:" % args.compare] + lines))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,6 +24,8 @@ class TestActions(unit_tests.test_utils.CharmTestCase):
     def test_set_temp_url_secret_keystone_session_successful(self):
         self.patch_object(ch_core.hookenv, 'action_fail')
         self.patch_object(leadership, 'leader_get')
+        self.patch_object(api_utils, '_SESSIONS', new={})
+        self.patch_object(api_utils, '_cache_auth_state')
 
         actions.set_temp_url_secret()
 
@@ -44,3 +46,70 @@ class TestActions(unit_tests.test_utils.CharmTestCase):
         self.action_fail.assert_called_with(
             'Failed to create keystone session ("doh!")')
         self.leader_get.assert_not_called()
+
+    def test_prefetch_images(self):
+        self.patch_object(actions.reactive, 'is_flag_set')
+        self.is_flag_set.return_value = True
+        self.patch_object(ch_core.hookenv, 'action_get')
+        self.action_get.side_effect = lambda key: {
+            'image-ids': 'image1, image2',
+            'cache': 'instance'}[key]
+        self.patch_object(ch_core.hookenv, 'action_set')
+        self.patch_object(ch_core.hookenv, 'action_fail')
+        self.patch_object(api_utils, 'create_keystone_session')
+        self.patch_object(api_utils, 'OSClients')
+        self.patch_object(actions.controller_utils, 'prefetch_image')
+        self.ironic_charm.config = {
+            "image_cache": {"instance_master_path": "/fake/master"},
+            "image_conversion": {
+                "force_raw_images": True,
+                "image_convert_memory_limit": 1024}}
+
+        def prefetch(os_cli, image_id, master_dir, **kwargs):
+            if image_id == "image2":
+                raise Exception("doh!")
+        self.prefetch_image.side_effect = prefetch
+
+        actions.prefetch_images()
+
+        self.prefetch_image.assert_has_calls([
+            mock.call(self.OSClients(), "image1", "/fake/master",
+                      force_raw=True, memory_limit=1024),
+            mock.call(self.OSClients(), "image2", "/fake/master",
+                      force_raw=True, memory_limit=1024)])
+        self.action_set.assert_called_with({
+            'cached': 'image1',
+            'failed': 'image2'})
+        self.action_fail.assert_called_with(
+            'Failed to prefetch images: image2')
+
+    def test_show_hook_timings(self):
+        self.patch_object(ch_core.hookenv, 'action_get')
+        self.action_get.side_effect = lambda key: {
+            'hook': 'config-changed',
+            'count': 5}[key]
+        self.patch_object(ch_core.hookenv, 'action_set')
+        self.patch_object(actions.profiling, 'load_summaries')
+        self.load_summaries.return_value = [
+            {"hook": "config-changed", "phases": [
+                {"phase": "render", "duration": 2.0}]}]
+
+        actions.show_hook_timings()
+
+        self.load_summaries.assert_called_with(hook='config-changed')
+        self.action_set.assert_called_with({
+            'hooks': 1,
+            'timings': ('config-changed render: calls=1 mean=2.000s '
+                        'max=2.000s')})
+
+    def test_show_hook_timings_no_timings(self):
+        self.patch_object(ch_core.hookenv, 'action_get')
+        self.patch_object(ch_core.hookenv, 'action_fail')
+        self.patch_object(actions.profiling, 'load_summaries')
+        self.load_summaries.return_value = []
+
+        actions.show_hook_timings()
+
+        self.action_fail.assert_called_with(
+            'no hook timings found, enable the hook-profiling config '
+            'option first')
@@ -12,6 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import os
+import shutil
+import tempfile
+
 import mock
 
 import charms_openstack.test_utils as test_utils
@@ -28,6 +33,8 @@ class TestGetKeystoneSession(test_utils.PatchHelper):
 
     def setUp(self):
         super().setUp()
+        self.patch_object(api_utils, '_SESSIONS', new={})
+        self.patch_object(api_utils, '_cache_auth_state')
         self.ks_int = mock.MagicMock()
         self.ks_int.credentials_username.return_value = "ironic"
         self.ks_int.credentials_password.return_value = "super_secret"
@@ -59,7 +66,8 @@ class TestGetKeystoneSession(test_utils.PatchHelper):
         self.loading.get_plugin_loader.assert_called_with("v3password")
         loader.load_from_options.assert_called_with(**self.ks_expect)
         self.ks_session.Session.assert_called_with(
-            auth=auth, verify=api_utils.SYSTEM_CA_BUNDLE)
+            auth=auth, verify=api_utils.SYSTEM_CA_BUNDLE,
+            timeout=api_utils.API_TIMEOUT)
 
     def test_create_keystone_session_v2(self):
         self.patch_object(api_utils, 'loading')
@@ -76,7 +84,117 @@ class TestGetKeystoneSession(test_utils.PatchHelper):
         self.loading.get_plugin_loader.assert_called_with("password")
         loader.load_from_options.assert_called_with(**self.ks_expect)
         self.ks_session.Session.assert_called_with(
-            auth=auth, verify=api_utils.SYSTEM_CA_BUNDLE)
+            auth=auth, verify=api_utils.SYSTEM_CA_BUNDLE,
+            timeout=api_utils.API_TIMEOUT)
+
+    def test_create_keystone_session_reused(self):
+        self.patch_object(api_utils, 'loading')
+        self.patch_object(api_utils, 'ks_session')
+        auth = mock.MagicMock()
+        auth.get_cache_id.return_value = "fake-cache-id"
+        self.loading.get_plugin_loader().load_from_options.return_value = auth
+        session = api_utils.create_keystone_session(self.ks_int)
+        self.assertEqual(session, self.ks_session.Session.return_value)
+        self._cache_auth_state.assert_called_once_with(auth, session)
+
+        self.assertEqual(
+            api_utils.create_keystone_session(self.ks_int), session)
+        self.ks_session.Session.assert_called_once_with(
+            auth=auth, verify=api_utils.SYSTEM_CA_BUNDLE,
+            timeout=api_utils.API_TIMEOUT)
+        self._cache_auth_state.assert_called_once_with(auth, session)
+
+
+class TestCacheAuthState(test_utils.PatchHelper):
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.patch_object(api_utils.hookenv, 'charm_dir')
+        self.charm_dir.return_value = self.tmpdir
+        self.state_path = os.path.join(
+            self.tmpdir, api_utils.AUTH_STATE_FILE)
+        self.auth = mock.MagicMock()
+        self.auth.get_cache_id.return_value = "fake-cache-id"
+        self.session = mock.MagicMock()
+
+    def test_cache_auth_state(self):
+        self.auth.get_auth_state.return_value = '{"auth_token": "token1"}'
+        api_utils._cache_auth_state(self.auth, self.session)
+        self.auth.set_auth_state.assert_not_called()
+        self.session.get_token.assert_called_once_with()
+        with open(self.state_path) as fd:
+            self.assertEqual(json.load(fd), {
+                "fake-cache-id": '{"auth_token": "token1"}'})
+        self.assertEqual(os.stat(self.state_path).st_mode & 0o777, 0o600)
+
+    def test_cache_auth_state_cached(self):
+        with open(self.state_path, "w") as fd:
+            json.dump({"fake-cache-id": '{"auth_token": "token1"}'}, fd)
+        self.auth.get_auth_state.return_value = '{"auth_token": "token1"}'
+        self.patch_object(api_utils, '_save_auth_states')
+        api_utils._cache_auth_state(self.auth, self.session)
+        self.auth.set_auth_state.assert_called_once_with(
+            '{"auth_token": "token1"}')
+        self._save_auth_states.assert_not_called()
+
+    def test_cache_auth_state_expired(self):
+        # keystoneauth got a new token, as the cached one expired
+        with open(self.state_path, "w") as fd:
+            json.dump({
+                "fake-cache-id": '{"auth_token": "token1"}',
+                "other-cache-id": '{"auth_token": "token2"}'}, fd)
+        self.auth.get_auth_state.return_value = '{"auth_token": "token3"}'
+        api_utils._cache_auth_state(self.auth, self.session)
+        with open(self.state_path) as fd:
+            self.assertEqual(json.load(fd), {
+                "fake-cache-id": '{"auth_token": "token3"}',
+                "other-cache-id": '{"auth_token": "token2"}'})
+
+
+class TestGetReservedNodes(test_utils.PatchHelper):
+
+    def test_get_reserved_nodes(self):
+        session = mock.MagicMock()
+        session.get.return_value.json.return_value = {
+            "nodes": [
+                {"uuid": "node-1", "reservation": "conductor-1"},
+                {"uuid": "node-2", "reservation": None},
+                {"uuid": "node-3", "reservation": "conductor-1"},
+            ],
+            "next": "https://ironic/v1/nodes?marker=node-3",
+        }
+
+        self.assertEqual(
+            api_utils.get_reserved_nodes(session, "conductor-1"),
+            ["node-1", "node-3"])
+        # the next pages are not fetched
+        session.get.assert_called_once_with(
+            "/v1/nodes?conductor=conductor-1&fields=uuid,reservation"
+            "&limit=%d" % api_utils.MAX_RESERVATION_SCAN,
+            endpoint_filter={
+                "service_type": "baremetal",
+                "interface": "internal",
+            },
+            headers={api_utils.IRONIC_API_VERSION_HEADER: "1.49"})
+
+
+class TestRunConcurrently(test_utils.PatchHelper):
+
+    def test_run_concurrently(self):
+        self.assertEqual(api_utils.run_concurrently({
+            "first": lambda: 1,
+            "second": lambda: "two",
+        }), {"first": 1, "second": "two"})
+        self.assertEqual(api_utils.run_concurrently({}), {})
+
+    def test_run_concurrently_failure(self):
+        def fail():
+            raise ValueError("doh!")
+
+        with self.assertRaises(ValueError):
+            api_utils.run_concurrently({"first": lambda: 1, "second": fail})
 
 
 class TestOSClients(test_utils.PatchHelper):
@@ -98,9 +216,6 @@ class TestOSClients(test_utils.PatchHelper):
         self.patch_object(
             api_utils.swiftclient,
             'Connection', name="swift_con")
-        self.patch_object(
-            api_utils.keystoneclient.v3,
-            'Client', name="ks_client")
 
         self.mocked_glance = mock.MagicMock()
         self.glance_client.return_value = self.mocked_glance
@@ -109,14 +224,23 @@ class TestOSClients(test_utils.PatchHelper):
         self.mocked_swift = mock.MagicMock()
         self.swift_con.return_value = self.mocked_swift
 
-        self.mocked_ks = mock.MagicMock()
-        self.ks_client.return_value = self.mocked_ks
-
         self.target = api_utils.OSClients(self.session)
-        self.glance_client.assert_called_with(session=self.session, version=2)
-        self.swift_con.assert_called_with(
-            session=self.session, cacert=api_utils.SYSTEM_CA_BUNDLE)
-        self.ks_client.assert_called_with(session=self.session)
+
+    def test_lazy_clients(self):
+        self.glance_client.assert_not_called()
+        self.swift_con.assert_not_called()
+
+        self.assertEqual(self.target._img_cli, self.mocked_glance)
+        self.assertEqual(self.target._img_cli, self.mocked_glance)
+        self.glance_client.assert_called_once_with(
+            session=self.session, version=2,
+            connect_retries=api_utils.API_RETRIES)
+        self.swift_con.assert_not_called()
+
+        self.assertEqual(self.target._obj_cli, self.mocked_swift)
+        self.swift_con.assert_called_once_with(
+            session=self.session, cacert=api_utils.SYSTEM_CA_BUNDLE,
+            retries=api_utils.API_RETRIES, timeout=api_utils.API_TIMEOUT)
 
     def test_stores_info(self):
         self.assertEqual(self.target._stores_info, self.stores["stores"])
@@ -132,6 +256,20 @@ class TestOSClients(test_utils.PatchHelper):
         self.stores["stores"][1]["default"] = True
         self.assertEqual(self.target.get_default_glance_store(), "local")
 
+    def test_get_image(self):
+        self.mocked_glance.images.get.return_value = {"id": "fake"}
+        self.assertEqual(self.target.get_image("fake"), {"id": "fake"})
+        self.mocked_glance.images.get.assert_called_with("fake")
+
+    def test_download_image(self):
+        self.mocked_glance.images.data.return_value = [b"chunk1", b"chunk2"]
+        with mock.patch('builtins.open', mock.mock_open()) as mocked_open:
+            self.target.download_image("fake", "/tmp/fake")
+        mocked_open.assert_called_with("/tmp/fake", "wb")
+        mocked_open().write.assert_has_calls([
+            mock.call(b"chunk1"), mock.call(b"chunk2")])
+        self.mocked_glance.images.data.assert_called_with("fake")
+
     def test_get_object_account_properties(self):
         props = {
             "x-account-meta-fakeprop": "hi there",
@@ -142,7 +280,7 @@ class TestOSClients(test_utils.PatchHelper):
             "fakeprop": "hi there",
             "fakeprop2": "bye there",
         }
-        self.mocked_swift.get_account.return_value = (props, "")
+        self.mocked_swift.head_account.return_value = props
         result = self.target.get_object_account_properties()
         self.assertEqual(result, expected_result)
 
@@ -150,7 +288,7 @@ class TestOSClients(test_utils.PatchHelper):
         props = {
             "x-account-meta-fakeprop": "hi there",
         }
-        self.mocked_swift.get_account.return_value = (props, "")
+        self.mocked_swift.head_account.return_value = props
 
         self.target.set_object_account_property("FaKePrOp", "hi there")
         self.mocked_swift.post_account.assert_not_called()
@@ -159,34 +297,36 @@ class TestOSClients(test_utils.PatchHelper):
         self.mocked_swift.post_account.assert_called_with(
             {"x-account-meta-fakeprop2": "bye there"})
 
+    def test_set_object_account_property_current_props(self):
+        self.target.set_object_account_property(
+            "FaKePrOp", "hi there", current_props={"fakeprop": "hi there"})
+        self.mocked_swift.head_account.assert_not_called()
+        self.mocked_swift.post_account.assert_not_called()
+
+        self.target.set_object_account_property(
+            "FaKePrOp", "bye there", current_props={"fakeprop": "hi there"})
+        self.mocked_swift.head_account.assert_not_called()
+        self.mocked_swift.post_account.assert_called_with(
+            {"x-account-meta-fakeprop": "bye there"})
+
     def test_delete_object_account_property(self):
         self.target.delete_object_account_property("FaKePrOp2")
         self.mocked_swift.post_account.assert_called_with(
             {"x-account-meta-fakeprop2": ""})
 
     def test_has_service_type(self):
-        mocked_svc_find = mock.MagicMock()
-        mocked_svc_find.id = "fakeid"
-
-        self.ks_client.services.find.return_value = mocked_svc_find
-        self.target._ks = self.ks_client
-
-        result = self.target._has_service_type(
-            "object-store", interface="public")
-        self.ks_client.services.find.assert_called_with(
-            type="object-store")
-        self.ks_client.endpoints.find.assert_called_with(
-            service_id="fakeid", interface="public")
-        self.assertTrue(result)
+        self.session.get_endpoint.return_value = "https://swift:443"
+        self.assertTrue(self.target._has_service_type(
+            "object-store", interface="public"))
+        self.session.get_endpoint.assert_called_with(
+            service_type="object-store", interface="public")
 
     def test_does_not_have_service_type(self):
-        ks_exc.http.NotFound = _NotFoundException
-        self.ks_client.services.find.side_effect = ks_exc.http.NotFound()
-        self.target._ks = self.ks_client
-
-        result = self.target._has_service_type(
-            "object-store", interface="public")
-        self.ks_client.services.find.assert_called_with(
-            type="object-store")
-        self.ks_client.endpoints.find.assert_not_called()
-        self.assertFalse(result)
+        self.session.get_endpoint.return_value = None
+        self.assertFalse(self.target._has_service_type(
+            "object-store", interface="public"))
+
+        ks_exc.EndpointNotFound = _NotFoundException
+        self.session.get_endpoint.side_effect = ks_exc.EndpointNotFound()
+        self.assertFalse(self.target._has_service_type(
+            "object-store", interface="public"))
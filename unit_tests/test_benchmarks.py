@@ -0,0 +1,59 @@
+# Copyright 2026 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import unit_tests.benchmarks.run as bench
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_summarize(self):
+        result = bench.summarize(
+            [0.001, 0.003, 0.002, 0.010], [2048, 4096])
+        self.assertEqual(result["runs"], 4)
+        self.assertAlmostEqual(result["median_ms"], 2.5)
+        self.assertAlmostEqual(result["p90_ms"], 10.0)
+        self.assertAlmostEqual(result["mean_ms"], 4.0)
+        self.assertEqual(result["peak_kib"], 4.0)
+
+    def test_compare_results(self):
+        baseline = {"results": {
+            "init": {"median_ms": 1.0},
+            "render": {"median_ms": 10.0},
+            "install": {"median_ms": 0.01},
+        }}
+        current = {"results": {
+            "init": {"median_ms": 1.1},
+            "render": {"median_ms": 13.0},
+            # large relative growth, but below the noise floor
+            "install": {"median_ms": 0.03},
+            "custom_assess_status_check": {"median_ms": 2.0},
+        }}
+        lines, regressions = bench.compare_results(
+            baseline, current, threshold=20)
+        self.assertEqual(regressions, ["render"])
+        self.assertEqual(len(lines), 4)
+        self.assertIn("REGRESSION", lines[1])
+        self.assertIn("(new)", lines[3])
+
+        _, regressions = bench.compare_results(
+            baseline, current, threshold=50)
+        self.assertEqual(regressions, [])
+
+    def test_release_comparator(self):
+        release = bench._CompareOpenStackReleases("yoga")
+        self.assertTrue(release >= "xena")
+        self.assertTrue(release < "bobcat")
+        self.assertFalse(release >= "antelope")
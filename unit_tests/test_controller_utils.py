@@ -15,6 +15,8 @@
 import os
 import mock
 import shutil
+import subprocess
+import tempfile
 
 import charms_openstack.test_utils as test_utils
 import charmhelpers.core.host as ch_host
@@ -48,6 +50,110 @@ class TestGetPXEBootClass(test_utils.PatchHelper):
                 pxe_class, controller_utils.PXEBootYoga))
 
 
+class TestImageCache(test_utils.PatchHelper):
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.master_dir = os.path.join(self.tmpdir, "master_images")
+        self.os_cli = mock.MagicMock()
+        self.os_cli.get_image.return_value = {
+            "id": "fake-id", "size": 10, "disk_format": "qcow2"}
+
+        def download_image(image_id, path):
+            with open(path, "w") as fd:
+                fd.write("fake image")
+        self.os_cli.download_image.side_effect = download_image
+        self.patch_object(shutil, 'chown')
+
+    def test_get_free_space(self):
+        self.patch_object(os, 'statvfs')
+        self.statvfs.return_value = mock.MagicMock(f_bavail=10, f_frsize=512)
+        self.assertEqual(
+            controller_utils.get_free_space(
+                os.path.join(self.tmpdir, "missing", "dir")),
+            5120)
+        self.statvfs.assert_called_with(self.tmpdir)
+
+    def test_get_dir_usage(self):
+        self.assertEqual(controller_utils.get_dir_usage(self.master_dir), 0)
+        os.makedirs(os.path.join(self.master_dir, "tmpdir"))
+        with open(os.path.join(self.master_dir, "image"), "w") as fd:
+            fd.write("x" * 100)
+        self.assertEqual(controller_utils.get_dir_usage(self.master_dir), 100)
+
+    def test_prefetch_image(self):
+        self.patch_object(subprocess, 'check_call')
+
+        def convert(cmd):
+            shutil.copy(cmd[-2], cmd[-1])
+        self.check_call.side_effect = convert
+
+        path = controller_utils.prefetch_image(
+            self.os_cli, "fake-id", self.master_dir)
+        # ironic.drivers.modules.image_cache names the master files of the
+        # images fetched with force_raw <image ID>.converted
+        self.assertEqual(
+            path, os.path.join(self.master_dir, "fake-id.converted"))
+        self.assertEqual(os.listdir(self.master_dir), ["fake-id.converted"])
+        self.check_call.assert_called_once_with([
+            "qemu-img", "convert", "-O", "raw", mock.ANY, mock.ANY])
+        self.chown.assert_any_call(
+            self.master_dir,
+            controller_utils._IRONIC_USER,
+            controller_utils._IRONIC_GROUP)
+
+    def test_prefetch_image_memory_limit(self):
+        self.patch_object(subprocess, 'check_call')
+
+        def convert(cmd):
+            shutil.copy(cmd[-2], cmd[-1])
+        self.check_call.side_effect = convert
+
+        controller_utils.prefetch_image(
+            self.os_cli, "fake-id", self.master_dir, memory_limit=1024)
+        self.check_call.assert_called_once_with([
+            "prlimit", "--as=1073741824", "--",
+            "qemu-img", "convert", "-O", "raw", mock.ANY, mock.ANY])
+
+    def test_prefetch_image_raw(self):
+        self.patch_object(subprocess, 'check_call')
+        self.os_cli.get_image.return_value["disk_format"] = "raw"
+        controller_utils.prefetch_image(
+            self.os_cli, "fake-id", self.master_dir)
+        self.check_call.assert_not_called()
+        with open(os.path.join(self.master_dir, "fake-id.converted")) as fd:
+            self.assertEqual(fd.read(), "fake image")
+
+    def test_prefetch_image_no_force_raw(self):
+        self.patch_object(subprocess, 'check_call')
+        path = controller_utils.prefetch_image(
+            self.os_cli, "fake-id", self.master_dir, force_raw=False)
+        self.check_call.assert_not_called()
+        self.assertEqual(path, os.path.join(self.master_dir, "fake-id"))
+        self.assertEqual(os.listdir(self.master_dir), ["fake-id"])
+
+    def test_prefetch_image_already_cached(self):
+        os.makedirs(self.master_dir)
+        master_path = os.path.join(self.master_dir, "fake-id.converted")
+        with open(master_path, "w") as fd:
+            fd.write("fake image")
+        os.utime(master_path, (0, 0))
+        controller_utils.prefetch_image(
+            self.os_cli, "fake-id", self.master_dir)
+        self.os_cli.download_image.assert_not_called()
+        self.assertNotEqual(os.stat(master_path).st_mtime, 0)
+
+    def test_prefetch_image_not_enough_space(self):
+        self.patch_object(controller_utils, 'get_free_space')
+        self.get_free_space.return_value = 15
+        with self.assertRaises(ValueError):
+            controller_utils.prefetch_image(
+                self.os_cli, "fake-id", self.master_dir)
+        self.os_cli.download_image.assert_not_called()
+
+
 class TestPXEBootBase(test_utils.PatchHelper):
 
     def setUp(self):
@@ -55,41 +161,33 @@ class TestPXEBootBase(test_utils.PatchHelper):
         self.target = controller_utils.PXEBootBase({})
 
     def test_ensure_folders(self):
-        global _TEST_FOLDERS
         self.patch_object(os.path, 'isdir')
-        self.isdir.side_effect = [False, False, False]
+        self.isdir.side_effect = [False, True, False]
         self.patch_object(os, 'makedirs')
-        self.patch_object(ch_host, 'chownr')
+        self.patch_object(shutil, 'chown')
         self.target._ensure_folders()
+        folders = [
+            controller_utils.PXEBootBase.TFTP_ROOT,
+            controller_utils.PXEBootBase.HTTP_ROOT,
+            controller_utils.PXEBootBase.GRUB_DIR,
+        ]
         chown_call_list = [
             mock.call(
-                controller_utils.PXEBootBase.TFTP_ROOT,
-                controller_utils._IRONIC_USER,
-                controller_utils._IRONIC_GROUP,
-                chowntopdir=True),
-            mock.call(
-                controller_utils.PXEBootBase.HTTP_ROOT,
+                i,
                 controller_utils._IRONIC_USER,
-                controller_utils._IRONIC_GROUP,
-                chowntopdir=True),
-        ]
-        isdir_call_list = [
-            mock.call(controller_utils.PXEBootBase.TFTP_ROOT),
-            mock.call(controller_utils.PXEBootBase.HTTP_ROOT),
-            mock.call(controller_utils.PXEBootBase.GRUB_DIR),
+                controller_utils._IRONIC_GROUP) for i in folders
         ]
-
-        makedirs_call_list = [
+        self.isdir.assert_has_calls([mock.call(i) for i in folders])
+        self.makedirs.assert_has_calls([
             mock.call(controller_utils.PXEBootBase.TFTP_ROOT),
-            mock.call(controller_utils.PXEBootBase.HTTP_ROOT),
             mock.call(controller_utils.PXEBootBase.GRUB_DIR),
-        ]
-        self.isdir.assert_has_calls(isdir_call_list)
-        self.makedirs.assert_has_calls(makedirs_call_list)
-        ch_host.chownr.assert_has_calls(chown_call_list)
+        ])
+        self.assertEqual(self.makedirs.call_count, 2)
+        self.chown.assert_has_calls(chown_call_list)
 
     def test_copy_resources_missing_file(self):
         self.patch_object(self.target, '_ensure_folders')
+        self.patch_object(controller_utils.unitdata, 'kv')
         self.patch_object(os.path, 'isfile')
         is_file_returns = list([
             True for i in controller_utils.PXEBootBase.FILE_MAP])
@@ -98,7 +196,33 @@ class TestPXEBootBase(test_utils.PatchHelper):
         with self.assertRaises(ValueError):
             self.target._copy_resources()
 
+    def _setup_copy_resources(self, current):
+        self.patch_object(self.target, '_ensure_folders')
+        self.patch_object(self.target, '_is_resource_current')
+        self._is_resource_current.return_value = (current, "fakedigest")
+        self.patch_object(os.path, 'isfile')
+        self.isfile.return_value = True
+        self.patch_object(os, 'stat')
+        self.stat.return_value = mock.MagicMock(st_mtime=10, st_size=20)
+        self.patch_object(shutil, 'copy')
+        self.patch_object(shutil, 'chown')
+        self.patch_object(controller_utils.unitdata, 'kv')
+        self.db = mock.MagicMock()
+        self.kv.return_value = self.db
+        entry = {
+            "digest": "fakedigest",
+            "source_mtime": 10,
+            "source_size": 20,
+            "mtime": 10,
+            "size": 20,
+        }
+        return dict([
+            (os.path.join(controller_utils.PXEBootBase.TFTP_ROOT, i), entry)
+            for i in controller_utils.PXEBootBase.FILE_MAP.values()])
+
     def test_copy_resources(self):
+        expected_manifest = self._setup_copy_resources(False)
+        self.db.get.return_value = {}
         shutil_calls = [
             mock.call(
                 i,
@@ -108,18 +232,86 @@ class TestPXEBootBase(test_utils.PatchHelper):
                 follow_symlinks=True
             ) for i in controller_utils.PXEBootBase.FILE_MAP
         ]
-        self.patch_object(self.target, '_ensure_folders')
-        self.patch_object(os.path, 'isfile')
-        self.patch_object(shutil, 'copy')
-        self.patch_object(ch_host, 'chownr')
-        self.isfile.side_effect = [
-            True for i in controller_utils.PXEBootBase.FILE_MAP]
+        chown_calls = [
+            mock.call(
+                os.path.join(
+                    controller_utils.PXEBootBase.TFTP_ROOT,
+                    controller_utils.PXEBootBase.FILE_MAP[i]),
+                controller_utils._IRONIC_USER,
+                controller_utils._IRONIC_GROUP,
+            ) for i in controller_utils.PXEBootBase.FILE_MAP
+        ]
 
         self.target._copy_resources()
         self._ensure_folders.assert_called_with()
         self.copy.assert_has_calls(shutil_calls)
-        self.chownr.assert_called_with(
-            controller_utils.PXEBootBase.TFTP_ROOT,
-            controller_utils._IRONIC_USER,
-            controller_utils._IRONIC_GROUP,
-            chowntopdir=True)
+        self.chown.assert_has_calls(chown_calls)
+        self.db.set.assert_called_with(
+            controller_utils._RESOURCES_MANIFEST_KEY, expected_manifest)
+
+    def test_copy_resources_uefi_http_boot(self):
+        self._setup_copy_resources(False)
+        self.db.get.return_value = {}
+        self.target._config = {"uefi-http-boot": True}
+        http_boot_calls = [
+            mock.call(
+                i,
+                os.path.join(
+                    controller_utils.PXEBootBase.HTTP_ROOT,
+                    controller_utils.PXEBootBase.HTTP_FILE_MAP[i]),
+                follow_symlinks=True
+            ) for i in controller_utils.PXEBootBase.HTTP_FILE_MAP
+        ]
+
+        self.target._copy_resources()
+        self.copy.assert_has_calls(http_boot_calls)
+        self.assertEqual(
+            self.copy.call_count,
+            len(controller_utils.PXEBootBase.FILE_MAP) +
+            len(controller_utils.PXEBootBase.HTTP_FILE_MAP))
+
+    def test_copy_resources_unchanged(self):
+        expected_manifest = self._setup_copy_resources(True)
+        self.db.get.return_value = expected_manifest
+
+        self.target._copy_resources()
+        self.copy.assert_not_called()
+        self.chown.assert_not_called()
+        self.db.set.assert_not_called()
+
+    def test_is_resource_current(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        src = os.path.join(tmpdir, "src")
+        dst = os.path.join(tmpdir, "dst")
+        with open(src, "w") as fd:
+            fd.write("boot loader")
+
+        self.assertEqual(
+            self.target._is_resource_current(src, dst, None),
+            (False, None))
+
+        with open(dst, "w") as fd:
+            fd.write("old boot loader")
+        current, digest = self.target._is_resource_current(src, dst, None)
+        self.assertFalse(current)
+        self.assertEqual(digest, controller_utils.file_digest(src))
+
+        shutil.copy(src, dst)
+        self.assertEqual(
+            self.target._is_resource_current(src, dst, None),
+            (True, digest))
+
+        src_stat = os.stat(src)
+        dst_stat = os.stat(dst)
+        entry = {
+            "digest": "fakedigest",
+            "source_mtime": src_stat.st_mtime,
+            "source_size": src_stat.st_size,
+            "mtime": dst_stat.st_mtime,
+            "size": dst_stat.st_size,
+        }
+        # stat info is unchanged, so the recorded digest is trusted.
+        self.assertEqual(
+            self.target._is_resource_current(src, dst, entry),
+            (True, "fakedigest"))
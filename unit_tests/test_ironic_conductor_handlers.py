@@ -41,6 +41,18 @@ class TestRegisteredHooks(test_utils.TestRegisteredHooks):
                     'amqp.connected',),
                 'request_database_access': (
                     'shared-db.connected',),
+                'restart_deferred_conductor': (
+                    'ironic-conductor.restart-deferred',),
+                'release_restart_token': (
+                    'ironic-conductor.rejoin-pending',),
+                'grant_restart_tokens': (
+                    'leadership.is_leader',),
+                'copy_boot_loaders': (
+                    'charm.installed',),
+                'publish_rpc_transport': (
+                    'ironic-api.available',),
+                'configure_token_cache': (
+                    'config.changed.token-cache',),
             },
             'hook': {
                 'upgrade_charm': ('upgrade-charm',),
@@ -56,6 +68,7 @@ class TestIronicHandlers(test_utils.PatchHelper):
     def setUp(self):
         super().setUp()
         self.patch_release(ironic.IronicConductorCharm.release)
+        self.patch_object(handlers.profiling, 'enabled', return_value=False)
         self.ironic_charm = mock.MagicMock()
         self.patch_object(handlers.charm, 'provide_charm_instance',
                           new=mock.MagicMock())
@@ -80,6 +93,8 @@ class TestIronicHandlers(test_utils.PatchHelper):
             ('fake', 'interface', 'list'))
         self.optional_interfaces.assert_called_once_with(
             ('arg1', 'arg2'))
+        self.ironic_charm.configure_deploy_logs_retention.\
+            assert_called_once_with()
         self.ironic_charm.configure_tls.assert_called_once_with()
         self.ironic_charm.assess_status.assert_called_once_with()
         self.set_state.assert_called_once_with('config.complete')
@@ -116,3 +131,29 @@ class TestIronicHandlers(test_utils.PatchHelper):
         handlers.request_database_access(database)
         database.configure.assert_has_calls(calls, any_order=True)
         self.ironic_charm.assess_status.assert_called_once_with()
+
+    def test_restart_deferred_conductor(self):
+        handlers.restart_deferred_conductor()
+        self.ironic_charm.restart_conductor.assert_called_once_with()
+        self.ironic_charm.assess_status.assert_called_once_with()
+
+    def test_release_restart_token(self):
+        handlers.release_restart_token()
+        self.ironic_charm.release_restart_token.assert_called_once_with()
+        self.ironic_charm.assess_status.assert_called_once_with()
+
+    def test_grant_restart_tokens(self):
+        handlers.grant_restart_tokens()
+        self.ironic_charm.grant_restart_tokens.assert_called_once_with()
+
+    def test_copy_boot_loaders(self):
+        handlers.copy_boot_loaders()
+        self.ironic_charm.pxe_config._copy_resources.assert_called_once_with()
+
+    def test_publish_rpc_transport(self):
+        handlers.publish_rpc_transport(mock.MagicMock())
+        self.ironic_charm.publish_rpc_transport.assert_called_once_with()
+
+    def test_configure_token_cache(self):
+        handlers.configure_token_cache()
+        self.ironic_charm.configure_token_cache.assert_called_once_with()
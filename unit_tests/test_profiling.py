@@ -0,0 +1,135 @@
+# Copyright 2026 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import charms_openstack.test_utils as test_utils
+
+import charm.openstack.ironic.profiling as profiling
+
+
+class TestProfiling(test_utils.PatchHelper):
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.patch_object(profiling.hookenv, 'config')
+        self.config.return_value = {"hook-profiling": True}
+        self.patch_object(profiling.hookenv, 'charm_dir')
+        self.charm_dir.return_value = self.tmpdir
+        self.patch_object(profiling.hookenv, 'hook_name')
+        self.hook_name.return_value = "config-changed"
+        self.patch_object(profiling.hookenv, 'atexit')
+        self.patch_object(profiling, '_state', new={
+            "profiler": None,
+            "started": None,
+            "depth": 0,
+            "phases": [],
+        })
+        self.addCleanup(self._disable_profiler, profiling._state)
+
+    def _disable_profiler(self, state):
+        if state["profiler"] is not None:
+            state["profiler"].disable()
+
+    def test_phase_disabled(self):
+        self.config.return_value = {}
+        with profiling.phase("render"):
+            pass
+        self.atexit.assert_not_called()
+        self.assertEqual(profiling._state["phases"], [])
+
+    def test_start(self):
+        with mock.patch.dict(os.environ, {"JUJU_UNIT_NAME": "ironic/0"}):
+            profiling.start()
+        self.atexit.assert_called_once_with(profiling._finish)
+        self.assertIsNotNone(profiling._state["profiler"])
+
+    def test_start_disabled(self):
+        self.config.return_value = {}
+        with mock.patch.dict(os.environ, {"JUJU_UNIT_NAME": "ironic/0"}):
+            profiling.start()
+        self.atexit.assert_not_called()
+
+    def test_start_outside_hook(self):
+        with mock.patch.dict(os.environ, clear=True):
+            profiling.start()
+        self.atexit.assert_not_called()
+        self.assertIsNone(profiling._state["profiler"])
+
+    def test_phase(self):
+        with profiling.phase("render"):
+            with profiling.phase("assess_status"):
+                pass
+        self.atexit.assert_called_once_with(profiling._finish)
+        self.assertEqual(
+            [(i["phase"], i["depth"]) for i in profiling._state["phases"]],
+            [("assess_status", 1), ("render", 0)])
+
+    def test_timed(self):
+        @profiling.timed("install")
+        def install(arg):
+            return arg
+
+        self.assertEqual(install("fake"), "fake")
+        self.assertEqual(install.__name__, "install")
+        self.assertEqual(profiling._state["phases"][0]["phase"], "install")
+
+    def test_finish(self):
+        with profiling.phase("render"):
+            pass
+        profiling._finish()
+        files = sorted(os.listdir(profiling.get_profiles_dir()))
+        self.assertEqual(len(files), 2)
+        self.assertTrue(files[0].endswith("-config-changed.json"))
+        self.assertTrue(files[1].endswith("-config-changed.prof"))
+        summaries = profiling.load_summaries()
+        self.assertEqual(summaries[0]["hook"], "config-changed")
+        self.assertEqual(summaries[0]["phases"][0]["phase"], "render")
+        self.assertEqual(profiling.load_summaries(hook="install"), [])
+        self.assertIsNone(profiling._state["profiler"])
+
+    def test_prune(self):
+        profiles_dir = profiling.get_profiles_dir()
+        os.makedirs(profiles_dir)
+        for i in range(profiling.MAX_PROFILES + 2):
+            for ext in (".json", ".prof"):
+                path = os.path.join(profiles_dir, "%03d-hook%s" % (i, ext))
+                open(path, "w").close()
+        profiling._prune(profiles_dir)
+        files = os.listdir(profiles_dir)
+        self.assertEqual(len(files), profiling.MAX_PROFILES * 2)
+        self.assertNotIn("000-hook.json", files)
+        self.assertNotIn("001-hook.prof", files)
+
+    def test_get_slowest_phases(self):
+        summaries = [
+            {"hook": "config-changed", "phases": [
+                {"phase": "render", "duration": 4.0},
+                {"phase": "assess_status", "duration": 1.0}]},
+            {"hook": "config-changed", "phases": [
+                {"phase": "render", "duration": 2.0}]},
+            {"hook": "update-status", "phases": [
+                {"phase": "assess_status", "duration": 3.0}]},
+        ]
+        self.assertEqual(
+            profiling.get_slowest_phases(summaries, count=2),
+            [{"hook": "config-changed", "phase": "render", "calls": 2,
+              "mean": 3.0, "max": 4.0},
+             {"hook": "update-status", "phase": "assess_status", "calls": 1,
+              "mean": 3.0, "max": 3.0}])
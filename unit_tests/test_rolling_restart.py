@@ -0,0 +1,126 @@
+# Copyright 2026 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import charms_openstack.test_utils as test_utils
+
+import charm.openstack.ironic.rolling_restart as rolling_restart
+
+
+class TestRollingRestart(test_utils.PatchHelper):
+
+    def setUp(self):
+        super().setUp()
+        self.leader_settings = {}
+        self.patch_object(rolling_restart.leadership, 'leader_get')
+        self.leader_get.side_effect = self.leader_settings.get
+        self.patch_object(rolling_restart.leadership, 'leader_set')
+        self.leader_set.side_effect = self.leader_settings.update
+        self.relation_data = {}
+        self.patch_object(rolling_restart.hookenv, 'relation_ids')
+        self.relation_ids.return_value = ["cluster:1"]
+        self.patch_object(rolling_restart.hookenv, 'local_unit')
+        self.local_unit.return_value = "ironic-conductor/0"
+        self.patch_object(rolling_restart.hookenv, 'related_units')
+        self.related_units.return_value = [
+            "ironic-conductor/1", "ironic-conductor/2"]
+        self.patch_object(rolling_restart.hookenv, 'relation_get')
+        self.relation_get.side_effect = (
+            lambda attribute, rid, unit:
+            self.relation_data.get(unit, {}).get(attribute))
+        self.patch_object(rolling_restart.hookenv, 'relation_set')
+        self.relation_set.side_effect = self._relation_set
+        self.patch_object(rolling_restart.hookenv, 'is_leader')
+        self.is_leader.return_value = False
+        self.patch_object(rolling_restart.time, 'time')
+        self.time.return_value = 1000.0
+
+    def _relation_set(self, relation_id, relation_settings):
+        data = self.relation_data.setdefault(self.local_unit(), {})
+        for key, value in relation_settings.items():
+            if value is None:
+                data.pop(key, None)
+            else:
+                data[key] = value
+
+    def test_get_requests(self):
+        self.relation_data = {
+            "ironic-conductor/0": {"restart-requested": "20.0"},
+            "ironic-conductor/2": {"restart-requested": "10.0"},
+        }
+        self.assertEqual(rolling_restart.get_requests(), {
+            "ironic-conductor/0": 20.0,
+            "ironic-conductor/2": 10.0,
+        })
+        self.relation_ids.return_value = []
+        self.assertEqual(rolling_restart.get_requests(), {})
+
+    def test_grant_tokens(self):
+        self.relation_data = {
+            "ironic-conductor/0": {"restart-requested": "30.0"},
+            "ironic-conductor/1": {"restart-requested": "20.0"},
+            "ironic-conductor/2": {"restart-requested": "10.0"},
+        }
+        self.assertEqual(
+            rolling_restart.grant_tokens(2),
+            ["ironic-conductor/2", "ironic-conductor/1"])
+
+        # tokens are only handed out again once they are released
+        del self.relation_data["ironic-conductor/1"]
+        self.leader_set.reset_mock()
+        self.assertEqual(
+            rolling_restart.grant_tokens(2),
+            ["ironic-conductor/2", "ironic-conductor/0"])
+        self.leader_set.assert_called_once_with({
+            "restart-tokens": json.dumps(
+                ["ironic-conductor/2", "ironic-conductor/0"])})
+
+        # nothing changed, the leader settings are left alone
+        self.leader_set.reset_mock()
+        rolling_restart.grant_tokens(2)
+        self.leader_set.assert_not_called()
+
+    def test_acquire_token(self):
+        self.assertFalse(rolling_restart.acquire_token(1))
+        self.assertEqual(self.relation_data["ironic-conductor/0"], {
+            "restart-requested": "1000.0"})
+
+        # the request keeps its place in the queue
+        self.time.return_value = 2000.0
+        self.leader_settings["restart-tokens"] = json.dumps(
+            ["ironic-conductor/0"])
+        self.assertTrue(rolling_restart.acquire_token(1))
+        self.assertEqual(self.relation_data["ironic-conductor/0"], {
+            "restart-requested": "1000.0"})
+
+    def test_acquire_token_leader(self):
+        self.is_leader.return_value = True
+        self.relation_data = {
+            "ironic-conductor/1": {"restart-requested": "10.0"},
+        }
+        self.assertFalse(rolling_restart.acquire_token(1))
+        self.assertTrue(rolling_restart.acquire_token(2))
+
+    def test_acquire_token_no_peers(self):
+        self.relation_ids.return_value = []
+        self.assertTrue(rolling_restart.acquire_token(1))
+        self.relation_set.assert_not_called()
+
+    def test_release_token(self):
+        self.relation_data = {
+            "ironic-conductor/0": {"restart-requested": "10.0"},
+        }
+        rolling_restart.release_token()
+        self.assertEqual(self.relation_data["ironic-conductor/0"], {})